@@ -21,3 +21,33 @@ class MyPageNumberPagination(pagination.PageNumberPagination):
     max_page_size = 20
 
 
+class MyKeysetPagination(pagination.CursorPagination):
+    """
+    按 (update_time, id) 的光标分页，翻到多深都只需一次索引范围查询
+    """
+    page_size = 11
+    ordering = ('-update_time', '-id')
+    page_size_query_param = 'size'
+    max_page_size = 20
+
+
+class ProjectPagination(MyPageNumberPagination):
+    """
+    项目下列表的分页，默认普通分页，请求参数带 cursor 时改用光标分页：
+        第一页 ?cursor=，之后使用返回的 next/previous 链接
+    """
+    cursor_query_param = 'cursor'
+
+    def __init__(self):
+        self.keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.keyset = MyKeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 import os
 import sys
 import djcelery
+from celery.schedules import crontab
 import configparser
 import datetime
 
@@ -235,11 +236,56 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
-CELERY_TASK_RESULT_EXPIRES = 3600
+CELERY_TASK_RESULT_EXPIRES = 24*60*60  # 定时任务子任务的结果要保留到汇总任务执行，不能短于整个任务的运行时间
 CELERYD_CONCURRENCY = 1 if DEBUG else 4  # 并发的worker数量
 CELERYD_MAX_TASKS_PER_CHILD = 100  # 每个worker最多执行100次任务被销毁，防止内存泄漏
 CELERY_FORCE_EXECV = True  # 有些情况可以防止死锁
 CELERY_TASK_TIME_LIMIT = 3*60*60  # 单个任务最大运行时间
+CELERYBEAT_SCHEDULE = {
+    'report_retention': {
+        'task': 'fastrunner.tasks.report_retention',
+        'schedule': crontab(hour=3, minute=0),  # 每天凌晨清理、归档测试报告
+    },
+}
+
+# 用例集并行执行
+SUITE_RUN_WORKERS = 1  # 默认并行执行的用例集数量，1 为串行
+SUITE_RUN_MAX_WORKERS = 16  # 单次运行请求允许的最大并行数量
+SCHEDULE_CASES_PER_TASK = 1  # 定时任务拆分子任务时每个子任务运行的用例数量
+SCHEDULE_ERROR_MAX_LENGTH = 2000  # 子任务返回给汇总任务的错误信息最大长度
+DEBUGTALK_WORKSPACE_MAX = 20  # 每个进程最多保留已加载驱动代码的项目数量，超出时只释放模块，不删除目录
+DEBUGTALK_WORKSPACE_MAX_AGE = 6*60*60  # 工作目录超过该秒数未使用才删除，需大于单个任务最大运行时间
+
+# 主体信息解析缓存
+BODY_CACHE_SIZE = 20000  # 进程内缓存的最大条数
+BODY_CACHE_BACKEND = None  # CACHES 中的缓存别名，设置后解析结果同时写入共享缓存，如 'default'
+
+# 项目统计、树形结构、用户所属项目缓存只使用多进程共享的缓存（如 memcached、数据库缓存），
+# 别名为空或对应进程内缓存 LocMemCache 时不缓存，每次从数据库查询
+# 项目统计缓存
+PROJECT_DETAIL_CACHE_BACKEND = None  # CACHES 中的缓存别名，如 'default'
+PROJECT_DETAIL_CACHE_TIMEOUT = 60  # 缓存秒数，不触发 signals 的写入最多延迟该时间
+
+# 树形结构缓存
+TREE_CACHE_BACKEND = None  # CACHES 中的缓存别名，如 'default'
+TREE_CACHE_TIMEOUT = 3600  # 缓存秒数，缓存按树的版本区分
+
+# 用户所属项目缓存
+PROJECT_MEMBER_CACHE_BACKEND = None  # CACHES 中的缓存别名，如 'default'
+PROJECT_MEMBER_CACHE_TIMEOUT = 300  # 缓存秒数
+
+# 测试报告压缩
+REPORT_COMPRESS_LEVEL = 6  # zlib 压缩级别
+REPORT_COMPRESS_MIN_SIZE = 1024  # 超过该长度的报告详情才压缩
+REPORT_HTML_MAX_BYTES = 200 * 1024  # 查看报告时 text/html 响应超过该长度则截断，不再格式化
+REPORT_BODY_MAX_SIZE = 64 * 1024  # 请求体或响应内容超过该长度时存入 MEDIA_ROOT/report_blobs，按内容去重
+REPORT_STEP_PAGE_SIZE = 50  # 查看报告时用例详情每页加载的步骤数
+REPORT_STEP_MAX_PAGE_SIZE = 200  # 用例详情每页最多的步骤数
+REPORT_SIGN_MAX_AGE = 2 * 60 * 60  # 报告页面按需加载用的签名有效秒数，只对该报告有效
+
+# 测试报告保留，策略见 ReportRetention
+REPORT_RETENTION_BATCH = 200  # 每个事务处理的报告数
+REPORT_ARCHIVE_ROOT = os.path.join(MEDIA_ROOT, 'report_archive')  # 报告详情归档目录
 
 # 邮件
 EMAIL_HOST = email_host
@@ -2,7 +2,9 @@
 import xadmin
 from xadmin import views
 
-from .models import Project, Config, API, Case, CaseStep, HostIP, Variables, Report, ModelWithFileField, Pycode
+from .models import Project, Config, API, Case, CaseStep, HostIP, Variables, Report, ReportDetail, ReportCase, \
+    ReportRetention, ModelWithFileField, Pycode
+from .utils.report import decompress_text
 from djcelery.models import TaskState, WorkerState, PeriodicTask, IntervalSchedule, CrontabSchedule, TaskMeta
 
 
@@ -72,6 +74,38 @@ class ReportAdmin(object):
     ordering = ['-create_time']
 
 
+class ReportDetailAdmin(object):
+    list_display = ['name', 'report', 'project', 'create_time']
+    search_fields = ['name', 'project__name']
+    list_filter = ['project', 'create_time']
+    readonly_fields = ['summary_text']
+    exclude = ['summary']
+    ordering = ['-create_time']
+
+    def summary_text(self, obj):
+        return decompress_text(obj.summary)
+    summary_text.short_description = "主体信息"
+
+
+class ReportCaseAdmin(object):
+    list_display = ['name', 'index', 'success', 'report', 'create_time']
+    search_fields = ['name', 'report__name']
+    list_filter = ['success', 'create_time']
+    readonly_fields = ['summary_text']
+    exclude = ['summary']
+    ordering = ['-create_time']
+
+    def summary_text(self, obj):
+        return decompress_text(obj.summary)
+    summary_text.short_description = "主体信息"
+
+
+class ReportRetentionAdmin(object):
+    list_display = ['project', 'keep_count', 'keep_days', 'keep_failure_days', 'archive_days', 'update_time']
+    search_fields = ['project__name']
+    ordering = ['-update_time']
+
+
 class ModelWithFileFieldAdmin(object):
     list_display = ['name', 'file', 'project', 'create_time', 'update_time']
     search_fields = ['name', 'file', 'project__name']
@@ -105,5 +139,8 @@ xadmin.site.register(CaseStep, CaseStepAdmin)
 xadmin.site.register(HostIP, HostIPAdmin)
 xadmin.site.register(Variables, VariablesAdmin)
 xadmin.site.register(Report, ReportAdmin)
+xadmin.site.register(ReportDetail, ReportDetailAdmin)
+xadmin.site.register(ReportCase, ReportCaseAdmin)
+xadmin.site.register(ReportRetention, ReportRetentionAdmin)
 xadmin.site.register(ModelWithFileField, ModelWithFileFieldAdmin)
 xadmin.site.register(Pycode, PycodeAdmin)
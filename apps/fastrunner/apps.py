@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FastrunnerConfig(AppConfig):
     name = 'fastrunner'
+
+    def ready(self):
+        from fastrunner import signals
@@ -0,0 +1,31 @@
+# _*_ coding: utf-8 _*_
+from django.core.management.base import BaseCommand
+
+from fastrunner import models
+from fastrunner.utils.prepare import clean_orphans
+
+
+class Command(BaseCommand):
+    """
+    清理以前删除节点时遗留的接口与用例，即 relation 指向树中已不存在节点的数据
+        python manage.py clean_tree_orphans --dry-run
+        python manage.py clean_tree_orphans --project 3
+    """
+    help = '删除挂在已不存在树节点上的 API、Case 及 CaseStep'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, action='append', help='只处理指定项目，可多次指定，默认全部')
+        parser.add_argument('--dry-run', action='store_true', help='只统计不删除')
+
+    def handle(self, *args, **options):
+        projects = models.Project.objects.order_by('id')
+        if options['project']:
+            projects = projects.filter(id__in=options['project'])
+
+        for project in projects:
+            for type, name in ((1, 'api'), (2, 'case')):
+                counts = clean_orphans(project, type, options['dry_run'])
+                if counts["nodes"]:
+                    self.stdout.write('%s %s: 孤立节点 %s，%s' % (project.name, name, counts.pop("nodes"), counts))
+
+        self.stdout.write(self.style.SUCCESS('完成' if not options['dry_run'] else '统计完成，未删除数据'))
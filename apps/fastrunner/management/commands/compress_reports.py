@@ -0,0 +1,58 @@
+# _*_ coding: utf-8 _*_
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from fastrunner import models
+from fastrunner.utils.report import compress_text
+
+# model -> 需要压缩的字段
+COMPRESS_FIELDS = {
+    'detail': (models.ReportDetail, ('summary',)),
+    'case': (models.ReportCase, ('summary',)),
+    'step': (models.ReportStep, ('summary',)),
+    'body': (models.ReportBody, ('request_body', 'response_content')),
+}
+
+
+class Command(BaseCommand):
+    """
+    压缩已有的测试报告详情
+    按 id 分批处理，每批一个事务，已压缩或过短的内容跳过，中断后可用 --start-id 继续
+        python manage.py compress_reports
+        python manage.py compress_reports --model detail --start-id 3000
+    """
+    help = '压缩 ReportDetail、ReportCase、ReportStep、ReportBody 中的报告详情'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(COMPRESS_FIELDS), action='append',
+                            help='只压缩指定的表，可多次指定，默认全部')
+        parser.add_argument('--batch-size', type=int, default=200, help='每批处理的行数')
+        parser.add_argument('--start-id', type=int, default=0, help='从该 id 之后开始处理')
+
+    def handle(self, *args, **options):
+        for name in options['model'] or sorted(COMPRESS_FIELDS):
+            model, fields = COMPRESS_FIELDS[name]
+            self.compress(name, model, fields, options['batch_size'], options['start_id'])
+
+    def compress(self, name, model, fields, batch_size, start_id):
+        last_id = start_id
+        compressed = 0
+        while True:
+            rows = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:batch_size])
+            if not rows:
+                break
+            with transaction.atomic():
+                for row in rows:
+                    values = {}
+                    for field, text in zip(fields, row[1:]):
+                        value = compress_text(text)
+                        if value != text:
+                            values[field] = value
+                    if values:
+                        # 内容不变，不更新 update_time
+                        model.objects.filter(id=row[0]).update(**values)
+                        compressed += 1
+            last_id = rows[-1][0]
+            self.stdout.write('%s: 已处理至 id=%s，压缩 %s 行' % (name, last_id, compressed))
+
+        self.stdout.write(self.style.SUCCESS('%s: 完成，共压缩 %s 行' % (name, compressed)))
@@ -0,0 +1,71 @@
+# _*_ coding: utf-8 _*_
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from fastrunner import models
+from fastrunner.utils.parser import dumps_body, loads_body
+
+# model -> 需要转换的字段
+CONVERT_FIELDS = {
+    'api': (models.API, 'body'),
+    'casestep': (models.CaseStep, 'body'),
+    'config': (models.Config, 'body'),
+    'relation': (models.Relation, 'tree'),
+    'file': (models.ModelWithFileField, 'excel_tree'),
+}
+
+
+def is_json(text):
+    try:
+        json.loads(text)
+        return True
+    except ValueError:
+        return False
+
+
+class Command(BaseCommand):
+    """
+    将旧数据中 str(dict) 格式的主体信息批量转换为 JSON
+    按 id 分批处理，每批一个事务，已是 JSON 的行跳过，中断后可用 --start-id 继续
+        python manage.py convert_body_json
+        python manage.py convert_body_json --model casestep --start-id 120000
+    """
+    help = '将 API/CaseStep/Config 的 body、Relation.tree、ModelWithFileField.excel_tree 转换为 JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(CONVERT_FIELDS), action='append',
+                            help='只转换指定的表，可多次指定，默认全部')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的行数')
+        parser.add_argument('--start-id', type=int, default=0, help='从该 id 之后开始处理')
+
+    def handle(self, *args, **options):
+        for name in options['model'] or sorted(CONVERT_FIELDS):
+            model, field = CONVERT_FIELDS[name]
+            self.convert(name, model, field, options['batch_size'], options['start_id'])
+
+    def convert(self, name, model, field, batch_size, start_id):
+        last_id = start_id
+        converted = 0
+        while True:
+            rows = list(model.objects.filter(id__gt=last_id).exclude(**{field + '__isnull': True}).
+                        order_by('id').values_list('id', field)[:batch_size])
+            if not rows:
+                break
+            with transaction.atomic():
+                for pk, text in rows:
+                    if not text or is_json(text):
+                        continue
+                    try:
+                        value = dumps_body(loads_body(text))
+                    except (ValueError, SyntaxError, TypeError) as e:
+                        self.stderr.write('%s id=%s 无法转换: %s' % (name, pk, e))
+                        continue
+                    # 内容不变，不更新 update_time
+                    model.objects.filter(id=pk).update(**{field: value})
+                    converted += 1
+            last_id = rows[-1][0]
+            self.stdout.write('%s: 已处理至 id=%s，转换 %s 行' % (name, last_id, converted))
+
+        self.stdout.write(self.style.SUCCESS('%s: 完成，共转换 %s 行' % (name, converted)))
@@ -0,0 +1,21 @@
+# _*_ coding: utf-8 _*_
+from django.core.management.base import BaseCommand
+
+from fastrunner.utils import search
+
+
+class Command(BaseCommand):
+    """
+    重建接口、用例、配置的搜索索引，上线搜索功能或索引与数据不一致时执行
+        python manage.py rebuild_search_index
+        python manage.py rebuild_search_index --project 3
+    """
+    help = '重建 SearchToken 搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='只重建指定项目，默认全部')
+        parser.add_argument('--batch-size', type=int, default=200, help='每批处理的行数')
+
+    def handle(self, *args, **options):
+        search.rebuild(options['project'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('搜索索引重建完成'))
@@ -27,6 +27,7 @@ class Project(BaseTable):
     name = models.CharField("项目名称", unique=True, null=False, max_length=100)
     desc = models.CharField("简要介绍", max_length=100, null=False)
     responsible = models.CharField("负责人", max_length=20, null=False)
+    report_prettify = models.BooleanField("报告中格式化HTML响应", default=False)
 
     def __str__(self):
         return self.name
@@ -41,6 +42,7 @@ class Config(BaseTable):
         verbose_name = "配置信息"
         verbose_name_plural = verbose_name
         unique_together = [['project', 'name']]
+        indexes = [models.Index(fields=['project', 'update_time'])]
 
     name = models.CharField("环境名称", null=False, max_length=100)
     body = models.TextField("主体信息", null=False)
@@ -59,6 +61,7 @@ class API(BaseTable):
     class Meta:
         verbose_name = "接口信息"
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['project', 'relation', 'update_time'])]
 
     name = models.CharField("接口名称", null=False, max_length=100)
     body = models.TextField("主体信息", null=False)
@@ -79,6 +82,7 @@ class Case(BaseTable):
     class Meta:
         verbose_name = "用例信息"
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['project', 'relation', 'update_time'])]
 
     tag = (
         (1, "冒烟用例"),
@@ -144,6 +148,7 @@ class Variables(BaseTable):
     class Meta:
         verbose_name = "全局变量"
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['project', 'update_time'])]
 
     key = models.CharField(null=False, max_length=100)
     value = models.CharField(null=False, max_length=1024)
@@ -162,20 +167,47 @@ class Report(BaseTable):
         (2, "异步"),
         (3, "定时")
     )
+    report_status = (
+        (0, "运行中"),
+        (1, "已完成")
+    )
 
     class Meta:
         verbose_name = "测试报告"
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['project', 'update_time'])]
 
     name = models.CharField("报告名称", null=False, max_length=100)
     type = models.IntegerField("报告类型", choices=report_type)
     summary = models.TextField("简要主体信息", null=False)
+    success = models.BooleanField("是否成功", null=True, default=None)
+    archive = models.CharField("归档文件", null=True, blank=True, max_length=255)
+    status = models.IntegerField("运行状态", choices=report_status, default=1)
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
 
     def __str__(self):
         return self.name
 
 
+class ReportRetention(BaseTable):
+    """
+    报告保留策略，未设置的项目使用字段默认值，天数为 0 表示不按时间处理
+    """
+
+    class Meta:
+        verbose_name = "报告保留策略"
+        verbose_name_plural = verbose_name
+
+    keep_count = models.IntegerField("保留最近报告数", default=100)
+    keep_days = models.IntegerField("成功报告保留天数", default=30)
+    keep_failure_days = models.IntegerField("失败报告保留天数", default=90)
+    archive_days = models.IntegerField("详情归档天数", default=7)
+    project = models.OneToOneField(Project, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.project.name
+
+
 class ReportDetail(BaseTable):
     """
     报告主题信息存储
@@ -194,6 +226,89 @@ class ReportDetail(BaseTable):
         return self.name
 
 
+class ReportCase(BaseTable):
+    """
+    报告用例详情，每个用例一条，运行过程中逐条写入
+    """
+
+    class Meta:
+        verbose_name = "报告用例详情"
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['report', 'success']),
+            models.Index(fields=['report', 'name']),
+        ]
+
+    name = models.CharField("用例名称", null=False, max_length=255)
+    index = models.IntegerField("用例集序号", default=0)
+    success = models.BooleanField("是否成功", default=True)
+    summary = models.TextField("主体信息", null=False)
+    report = models.ForeignKey(Report, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name
+
+
+class ReportStep(models.Model):
+    """
+    报告步骤记录，不含请求体与响应内容
+    """
+
+    class Meta:
+        verbose_name = "报告步骤记录"
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['case', 'index']),
+            models.Index(fields=['case', 'status']),
+        ]
+
+    name = models.CharField("步骤名称", null=False, max_length=255, db_index=True)
+    index = models.IntegerField("步骤序号", default=0)
+    status = models.CharField("运行状态", null=False, max_length=20, db_index=True)
+    elapsed_ms = models.FloatField("耗时", default=0, db_index=True)
+    summary = models.TextField("主体信息", null=False)
+    case = models.ForeignKey(ReportCase, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return self.name
+
+
+class ReportBody(models.Model):
+    """
+    报告步骤的请求体与响应内容，查看时才加载
+    """
+
+    class Meta:
+        verbose_name = "报告步骤内容"
+        verbose_name_plural = verbose_name
+        unique_together = ('case', 'index')
+
+    index = models.IntegerField("步骤序号", default=0)
+    request_body = models.TextField("请求体", null=True)
+    response_content = models.TextField("响应内容", null=True)
+    case = models.ForeignKey(ReportCase, on_delete=models.CASCADE)
+
+
+class SearchToken(models.Model):
+    """
+    搜索倒排索引
+    """
+
+    class Meta:
+        verbose_name = "搜索索引"
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['project', 'kind', 'token']),
+            models.Index(fields=['kind', 'object_id']),
+        ]
+
+    kind = models.CharField("对象类型", null=False, max_length=10)
+    object_id = models.IntegerField("对象id", null=False)
+    token = models.CharField("词", null=False, max_length=64)
+    weight = models.IntegerField("权重", default=1)
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+
+
 class Relation(models.Model):
     """
     树形结构关系
@@ -206,6 +321,30 @@ class Relation(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     tree = models.TextField("结构主题", null=False, default=[])
     type = models.IntegerField("树类型", default=1)
+    max_id = models.IntegerField("最大节点id", null=True, blank=True, help_text="为空时节点尚未从 tree 导入")
+    version = models.IntegerField("版本", default=0, help_text="节点每次修改加一")
+
+
+class RelationNode(models.Model):
+    """
+    树形结构节点
+    """
+
+    class Meta:
+        verbose_name = "树形结构节点"
+        verbose_name_plural = verbose_name
+        unique_together = [['project', 'type', 'node_id']]
+        indexes = [models.Index(fields=['project', 'type', 'parent_id', 'position'])]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    type = models.IntegerField("树类型", default=1)
+    node_id = models.IntegerField("节点id", null=False)
+    parent_id = models.IntegerField("父节点id", default=0, help_text="0 为根节点")
+    label = models.CharField("节点名称", max_length=100, null=False)
+    position = models.IntegerField("同级排序", default=0)
+
+    def __str__(self):
+        return self.label
 
 
 class ModelWithFileField(BaseTable):
@@ -216,6 +355,7 @@ class ModelWithFileField(BaseTable):
         verbose_name = "文件信息表"
         verbose_name_plural = verbose_name
         unique_together = [['project', 'name']]
+        indexes = [models.Index(fields=['project', 'relation', 'update_time'])]
 
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
@@ -256,6 +396,7 @@ class Pycode(BaseTable):
         verbose_name = "驱动文件库"
         verbose_name_plural = verbose_name
         unique_together = [['project', 'name']]
+        indexes = [models.Index(fields=['project', 'update_time'])]
 
     code = models.TextField("python代码", default="# _*_ coding:utf-8 _*_", null=False)
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
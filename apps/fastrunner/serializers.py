@@ -7,7 +7,8 @@ import xlrd
 from xlrd.biffh import XLRDError
 
 from fastrunner import models
-from fastrunner.utils.parser import Parse, parser_variables
+from fastrunner.utils.cache import load_body
+from fastrunner.utils.parser import Parse, parser_variables, loads_body
 from FasterRunner.settings import MEDIA_ROOT
 
 
@@ -42,7 +43,7 @@ class APISerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'url', 'method', 'project', 'relation', 'body']
 
     def get_body(self, obj):
-        parse = Parse(eval(obj.body))
+        parse = Parse(load_body(obj))
         parse.parse_http()
         return parse.testcase
 
@@ -69,14 +70,14 @@ class CaseStepSerializer(serializers.ModelSerializer):
         depth = 1
 
     def get_body(self, obj):
-        body = eval(obj.body)
+        body = load_body(obj)
         if "base_url" in body["request"].keys():
             return {
                 "name": body["name"],
                 "method": "config"
             }
         else:
-            parse = Parse(eval(obj.body))
+            parse = Parse(body)
             parse.parse_http()
             return parse.testcase
 
@@ -93,7 +94,7 @@ class ConfigSerializer(serializers.ModelSerializer):
         depth = 1
 
     def get_body(self, obj):
-        parse = Parse(eval(obj.body), level='config')
+        parse = Parse(load_body(obj), level='config')
         parse.parse_http()
         return parse.testcase
 
@@ -103,11 +104,12 @@ class ReportSerializer(serializers.ModelSerializer):
     报告信息序列化
     """
     type = serializers.CharField(source="get_type_display")
+    status = serializers.CharField(source="get_status_display")
     summary = serializers.SerializerMethodField()
 
     class Meta:
         model = models.Report
-        fields = ["id", "name", "type", "summary"]
+        fields = ["id", "name", "type", "status", "summary"]
 
     def get_summary(self, obj):
         summary = json.loads(obj.summary)
@@ -213,7 +215,7 @@ class FileSerializer(serializers.ModelSerializer):
 
     def get_excel_tree(self, obj):
         if obj.excel_tree:
-            return eval(obj.excel_tree)
+            return loads_body(obj.excel_tree)
         try:
             file_path = os.path.join(MEDIA_ROOT, str(obj.file))
             excel_info = xlrd.open_workbook(file_path)
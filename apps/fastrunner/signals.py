@@ -0,0 +1,92 @@
+# _*_ coding: utf-8 _*_
+import os
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from djcelery import models as celery_models
+
+from fastrunner import models
+from fastrunner.utils import cache, search
+from fastrunner.utils.permissions import clear_project_ids
+from fastrunner.utils.prepare import clear_project_detail
+from FasterRunner.settings import REPORT_ARCHIVE_ROOT
+
+
+@receiver(post_save, sender=models.API)
+@receiver(post_save, sender=models.CaseStep)
+@receiver(post_save, sender=models.Config)
+def cache_body(sender, instance, **kwargs):
+    """
+    保存时预先写入主体信息缓存
+    """
+    cache.cache_body(instance)
+
+
+@receiver(post_save, sender=models.API)
+def index_api(sender, instance, **kwargs):
+    search.index_api(instance)
+
+
+@receiver(post_save, sender=models.Config)
+def index_config(sender, instance, **kwargs):
+    search.index_config(instance)
+
+
+@receiver(post_save, sender=models.Case)
+def index_case(sender, instance, **kwargs):
+    search.index_case_on_commit(instance.id)
+
+
+@receiver(post_save, sender=models.CaseStep)
+def index_casestep(sender, instance, **kwargs):
+    search.index_case_on_commit(instance.case_id)
+
+
+@receiver(post_save, sender=models.API)
+@receiver(post_save, sender=models.Case)
+@receiver(post_save, sender=models.Config)
+@receiver(post_save, sender=models.Variables)
+@receiver(post_save, sender=models.Report)
+@receiver(post_save, sender=models.HostIP)
+@receiver(post_delete, sender=models.Config)
+@receiver(post_delete, sender=models.Variables)
+@receiver(post_delete, sender=models.Report)
+@receiver(post_delete, sender=models.HostIP)
+def clear_detail(sender, instance, **kwargs):
+    """
+    项目统计缓存失效，API/Case 删除不注册 post_delete 以保留批量删除，由 prepare 中的删除函数清除
+    """
+    clear_project_detail(instance.project_id)
+
+
+@receiver(post_save, sender=celery_models.PeriodicTask)
+@receiver(post_delete, sender=celery_models.PeriodicTask)
+def clear_task_detail(sender, instance, **kwargs):
+    if instance.description and str(instance.description).isdigit():
+        clear_project_detail(instance.description)
+
+
+@receiver(post_delete, sender=models.Report)
+def remove_archive(sender, instance, **kwargs):
+    """
+    删除报告时删除归档文件
+    """
+    if instance.archive:
+        path = os.path.join(REPORT_ARCHIVE_ROOT, instance.archive)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+@receiver(m2m_changed, sender=get_user_model().belong_project.through)
+def clear_belong_project(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    用户所属项目变更时清除缓存，reverse 时 instance 为 Project，pk_set 为用户 id
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            clear_project_ids([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        clear_project_ids(pk_set)
+    elif action == 'pre_clear':
+        clear_project_ids(sender.objects.filter(project_id=instance.pk).values_list('user_id', flat=True))
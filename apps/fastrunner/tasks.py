@@ -3,12 +3,18 @@ import django
 django.setup()
 
 import json
+import os
+import time
 
-from celery import shared_task  # 可以无需任何具体的应用程序实例创建任务
+from celery import shared_task, chord, group  # 可以无需任何具体的应用程序实例创建任务
 
 from fastrunner import models
-from fastrunner.utils.loader import save_summary, debug_suite, debug_api
-from fastrunner.utils.host import parse_host
+from FasterRunner.settings import SCHEDULE_CASES_PER_TASK, SCHEDULE_ERROR_MAX_LENGTH, MEDIA_ROOT
+from fastrunner.utils.loader import save_summary, debug_suite, debug_api, VariableSnapshot
+from fastrunner.utils.host import compile_hosts
+from fastrunner.utils.report import ReportWriter, load_run_summaries
+from fastrunner.utils.retention import run_retention
+from fastrunner.utils.cache import load_body, load_body_values
 from fastrunner.utils.email_send import send_result_email, prepare_email_content, control_email, parser_runresult, prepare_email_file, get_summary_report
 
 
@@ -29,72 +35,170 @@ def async_debug_test(test_case, project, name, report_name, config, test_data):
 
 
 @shared_task
-def async_debug_suite(suite, project, obj, report, config):
+def async_debug_suite(suite, project, obj, report, config, workers=None):
     """异步执行suite
     """
-    summary = debug_suite(suite, project, obj, config=config, save=False)
-    save_summary(report, summary, project)
+    writer = ReportWriter.create(report, project)
+    try:
+        debug_suite(suite, project, obj, config=config, save=False, workers=workers, writer=writer)
+    except Exception as e:
+        writer.finish(error=e)
+        raise
+    writer.finish()
+
+
+def debug_schedule_case(cases, project, variables=None):
+    """运行定时任务里的单条用例，返回summary
+        variables: 同批用例共用的全局变量快照
+    """
+    case_kwargs = cases.get('kwargs', '')
+    test_list = models.CaseStep.objects.filter(case__id=cases["id"]).order_by("step").values("id", "body", "update_time")
+    if not test_list:
+        raise ValueError('用例缺失，请假查')
+    report_name = cases["name"]
+    case_name = cases["name"]
+    test_case = []
+    config = None
+    temp_config = []
+    test_data = None
+    temp_baseurl = ''
+    g_host_info = ''
+    resolver = compile_hosts(None)
+    if case_kwargs:
+        report_name = case_kwargs["testCaseName"]
+        if case_kwargs.get("excelTreeData", []):
+            test_data = tuple(case_kwargs["excelTreeData"])
+        if case_kwargs["hostInfo"] and case_kwargs["hostInfo"] != "请选择":
+            g_host_info = case_kwargs["hostInfo"]
+            host = models.HostIP.objects.get(name=g_host_info, project__id=project)
+            _host_info = json.loads(host.hostInfo)
+            temp_config.extend(_host_info["variables"])
+            temp_baseurl = host.base_url if host.base_url else ''
+            resolver = compile_hosts(host)
+
+    for content in test_list:
+        body = load_body_values(models.CaseStep, content)
+        if "base_url" in body["request"].keys():
+            config = load_body(models.Config.objects.get(name=body["name"], project__id=project))
+            continue
+        test_case.append(resolver.resolve(body))
+
+    if config and g_host_info not in ["请选择", '']:
+        config["variables"].extend(temp_config)
+        if temp_baseurl:
+            config["request"]["base_url"] = temp_baseurl
+    if not config and g_host_info not in ["请选择", '']:
+        config = {
+            "variables": temp_config,
+            "request": {
+                "base_url": temp_baseurl
+            }
+        }
+
+    summary = debug_api(test_case, project, name=case_name, config=resolver.resolve(config), save=False, test_data=test_data,
+                        variables=variables)
+    summary["name"] = report_name
+    return summary
 
 
 @shared_task
 def schedule_debug_suite(*args, **kwargs):
     """定时任务
+        按 SCHEDULE_CASES_PER_TASK 把用例拆成多个子任务并发执行，全部完成后由 schedule_debug_report 汇总
     """
     project = int(kwargs["project"])
 
-    sample_summary = []
     if not args:
         raise ValueError('任务列表为空，请检查')
-    for cases in args:
-        case_kwargs = cases.get('kwargs', '')
-        test_list = models.CaseStep.objects.filter(case__id=cases["id"]).order_by("step").values("body")
-        if not test_list:
-            raise ValueError('用例缺失，请假查')
-        report_name = cases["name"]
-        case_name = cases["name"]
-        test_case = []
-        config = None
-        temp_config = []
-        test_data = None
-        temp_baseurl = ''
-        g_host_info = ''
-        if case_kwargs:
-            report_name = case_kwargs["testCaseName"]
-            if case_kwargs.get("excelTreeData", []):
-                test_data = tuple(case_kwargs["excelTreeData"])
-            if case_kwargs["hostInfo"] and case_kwargs["hostInfo"] != "请选择":
-                g_host_info = case_kwargs["hostInfo"]
-                host = models.HostIP.objects.get(name=g_host_info, project__id=project)
-                _host_info = json.loads(host.hostInfo)
-                temp_config.extend(_host_info["variables"])
-                temp_baseurl = host.base_url if host.base_url else ''
-
-        for content in test_list:
-            body = eval(content["body"])
-            if "base_url" in body["request"].keys():
-                config = eval(models.Config.objects.get(name=body["name"], project__id=project).body)
-                continue
-            test_case.append(parse_host(g_host_info, body))
-
-        if config and g_host_info not in ["请选择", '']:
-            config["variables"].extend(temp_config)
-            if temp_baseurl:
-                config["request"]["base_url"] = temp_baseurl
-        if not config and g_host_info not in ["请选择", '']:
-            config = {
-                "variables": temp_config,
-                "request": {
-                    "base_url": temp_baseurl
-                }
-            }
+    report_id = ReportWriter.create(kwargs["task_name"], project, type=3).report_id
+    batch = max(1, SCHEDULE_CASES_PER_TASK)
+    # 子任务或汇总任务失败时汇总不会执行，由 schedule_debug_failed 结束报告
+    header = group(schedule_debug_cases.s(list(args[index:index + batch]), project, report_id, index).
+                   set(link_error=schedule_debug_failed.si(report_id))
+                   for index in range(0, len(args), batch))
+    callback = schedule_debug_report.s(report_id, **kwargs)
+    callback.link_error(schedule_debug_failed.si(report_id))
+    chord(header)(callback)
+
+
+def get_error_summary(name, error):
+    """
+    用例运行前出错（用例缺失、配置或驱动代码错误等）时的 summary，报告与邮件中记为一条失败
+    """
+    return {
+        "name": name,
+        "success": False,
+        "stat": {
+            "testsRun": 1,
+            "failures": 0,
+            "errors": 1,
+            "skipped": 0,
+            "expectedFailures": 0,
+            "unexpectedSuccesses": 0,
+            "successes": 0
+        },
+        "time": {
+            "start_at": time.time(),
+            "duration": 0
+        },
+        "platform": {},
+        "details": [],
+        "error": str(error)
+    }
+
+
+def get_case_result(summary, index):
+    """
+    子任务返回给汇总任务的简要结果，详情已经写入报告，不经过 celery 结果传递
+    """
+    errors = [str(record.get("attachment", "")) for detail in summary["details"] for record in detail["records"]
+              if record["status"] not in ["success", "skipped"]]
+    return {
+        "index": index,
+        "name": summary["name"],
+        "success": summary["success"],
+        "stat": summary["stat"],
+        "time": summary["time"],
+        "platform": summary["platform"],
+        "error": (summary.get("error") or "\n".join(errors))[:SCHEDULE_ERROR_MAX_LENGTH]
+    }
 
-        summary = debug_api(test_case, project, name=case_name, config=parse_host(g_host_info, config), save=False, test_data=test_data)
-        summary["name"] = report_name
-        sample_summary.append(summary)
 
-    if sample_summary:
+@shared_task
+def schedule_debug_cases(cases_list, project, report_id, start=0):
+    """定时任务子任务，运行一批用例，每条用例完成后立即写入报告
+        start: 这批用例在任务列表中的起始序号
+        返回每条用例的简要结果，单条用例出错时记为失败，不影响同批的其他用例
+    """
+    variables = VariableSnapshot(project)
+    writer = ReportWriter(report_id)
+    results = []
+    for index, cases in enumerate(cases_list):
+        try:
+            summary = debug_schedule_case(cases, project, variables=variables)
+        except Exception as e:
+            summary = get_error_summary(cases["name"], e)
+        if "status" in summary.keys():
+            summary = get_error_summary(cases["name"], summary["msg"])
+        writer.write(summary, index=start + index)
+        results.append(get_case_result(summary, start + index))
+    return results
+
+
+@shared_task
+def schedule_debug_report(results, report_id, **kwargs):
+    """定时任务汇总：结束报告并发送邮件
+        results: 各子任务返回的简要结果列表，顺序与任务列表一致
+        report_id: 子任务已经逐条写入的报告，发送邮件需要的详情从报告中读取
+    """
+    project = int(kwargs["project"])
+    results = [result for batch in results for result in batch]
+    ReportWriter(report_id).finish()
+
+    # 不发送邮件时不读取报告详情
+    if results and kwargs["strategy"] != '从不发送':
+        sample_summary = load_run_summaries(report_id, results)
         summary_report = get_summary_report(sample_summary)
-        save_summary(kwargs["task_name"], summary_report, project, type=3)
         is_send_email = control_email(sample_summary, kwargs)
         if is_send_email:
             sensitive_keys = kwargs.get('sensitive_keys', [])
@@ -113,3 +217,30 @@ def schedule_debug_suite(*args, **kwargs):
                 print('邮件发送成功')
             else:
                 print('邮件发送失败')
+
+
+@shared_task
+def schedule_debug_failed(report_id):
+    """
+    定时任务的子任务或汇总任务失败时结束报告，记为失败
+    """
+    ReportWriter(report_id).finish(error='定时任务执行失败，部分用例结果缺失')
+
+
+@shared_task
+def report_retention():
+    """定时清理测试报告
+        按项目保留策略删除过期报告、归档旧报告详情，由 CELERYBEAT_SCHEDULE 每天执行
+    """
+    return run_retention()
+
+
+@shared_task
+def remove_files(names):
+    """
+    删除 MEDIA_ROOT 下的文件，names 为 FileField 保存的相对路径
+    """
+    for name in names:
+        path = os.path.join(MEDIA_ROOT, name)
+        if name and os.path.isfile(path):
+            os.remove(path)
@@ -18,7 +18,7 @@ from django.urls import path
 from django.conf.urls import url, include
 from rest_framework.routers import DefaultRouter
 
-from fastrunner.views import project, api, config, schedule, run, suite, report, download, taskmeta, lock_files
+from fastrunner.views import project, api, config, schedule, run, suite, report, download, taskmeta, lock_files, search
 
 router = DefaultRouter()
 # 项目信息
@@ -61,6 +61,19 @@ urlpatterns = [
         'patch': 'patch'
     })),
 
+    # 树形结构节点
+    path('tree/<int:pk>/nodes/', project.TreeView.as_view({
+        'post': 'add_node'
+    })),
+
+    path('tree/<int:pk>/nodes/<int:node_id>/', project.TreeView.as_view({
+        'patch': 'update_node',
+        'delete': 'delete_node'
+    })),
+
+    # 全文搜索
+    path('search/', search.SearchView.as_view({"get": "list"})),
+
     # api接口模板地址
     path('api/', api.APITemplateView.as_view({
         "post": "add",
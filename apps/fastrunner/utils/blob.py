@@ -0,0 +1,75 @@
+# _*_ coding: utf-8 _*_
+import hashlib
+import os
+import re
+import tempfile
+import zlib
+
+from FasterRunner.settings import MEDIA_ROOT
+
+"""报告大内容文件存储
+    内容按 sha256 寻址，存放在 MEDIA_ROOT/report_blobs/<前两位>/<sha256>，zlib 压缩，相同内容只保存一份
+    数据库中只保存 BLOB_MARKER + sha256
+"""
+BLOB_ROOT = os.path.join(MEDIA_ROOT, 'report_blobs')
+BLOB_MARKER = 'blob:'
+
+_pattern = re.compile(r'^blob:[0-9a-f]{64}$')
+
+
+def is_blob(value):
+    return isinstance(value, str) and _pattern.match(value) is not None
+
+
+def get_path(digest):
+    return os.path.join(BLOB_ROOT, digest[:2], digest)
+
+
+def save_blob(text):
+    """
+    保存文本，返回引用
+    文件已存在时更新修改时间，清理任务不会删除刚被再次引用的文件
+    """
+    data = text.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    path = get_path(digest)
+    try:
+        os.utime(path)
+        return BLOB_MARKER + digest
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(zlib.compress(data))
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return BLOB_MARKER + digest
+
+
+def load_blob(ref):
+    """
+    读取引用对应的文本
+    """
+    with open(get_path(ref[len(BLOB_MARKER):]), 'rb') as stream:
+        return zlib.decompress(stream.read()).decode('utf-8')
+
+
+def iter_blobs():
+    """
+    遍历已保存的 (sha256, path)
+    """
+    if not os.path.isdir(BLOB_ROOT):
+        return
+    for prefix in os.listdir(BLOB_ROOT):
+        directory = os.path.join(BLOB_ROOT, prefix)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if len(name) == 64:
+                yield name, os.path.join(directory, name)
@@ -0,0 +1,106 @@
+# _*_ coding: utf-8 _*_
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from fastrunner.utils.parser import loads_body
+from FasterRunner.settings import BODY_CACHE_SIZE, BODY_CACHE_BACKEND
+
+"""API/CaseStep/Config 主体信息解析缓存
+    body 文本解析一次后按 (model, id, update_time) 缓存，进程内 LRU，
+    配置 BODY_CACHE_BACKEND 时同时写入共享缓存；缓存的是 pickle 数据，每次读取得到独立的副本
+"""
+_lock = threading.Lock()
+_bodies = OrderedDict()
+
+
+def get_shared_cache(alias):
+    """
+    返回 CACHES 中多进程共享的缓存，alias 为空或是进程内缓存时返回 None
+    进程内缓存的失效只作用于当前进程，其他 worker 会一直读到旧数据，此时不缓存
+    """
+    if not alias:
+        return None
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        return None
+    return cache
+
+
+def get_key(model, pk, update_time):
+    return 'body:%s:%s:%s' % (model._meta.label_lower, pk, update_time.isoformat())
+
+
+def parse_body(body):
+    """
+    body 文本解析为 dict
+    """
+    return loads_body(body)
+
+
+def _get(key):
+    with _lock:
+        data = _bodies.get(key)
+        if data is not None:
+            _bodies.move_to_end(key)
+            return data
+
+    if BODY_CACHE_BACKEND:
+        data = caches[BODY_CACHE_BACKEND].get(key)
+        if data is not None:
+            _set_local(key, data)
+    return data
+
+
+def _set_local(key, data):
+    with _lock:
+        _bodies[key] = data
+        _bodies.move_to_end(key)
+        while len(_bodies) > BODY_CACHE_SIZE:
+            _bodies.popitem(last=False)
+
+
+def _set(key, data):
+    _set_local(key, data)
+    if BODY_CACHE_BACKEND:
+        caches[BODY_CACHE_BACKEND].set(key, data)
+
+
+def get_body(model, pk, update_time, body):
+    """
+    返回解析后的 body，未缓存时解析并写入缓存
+    """
+    key = get_key(model, pk, update_time)
+    data = _get(key)
+    if data is not None:
+        return pickle.loads(data)
+
+    value = parse_body(body)
+    _set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    return value
+
+
+def load_body(obj):
+    """
+    obj: API/CaseStep/Config instance
+    """
+    return get_body(type(obj), obj.pk, obj.update_time, obj.body)
+
+
+def load_body_values(model, values):
+    """
+    values: dict from queryset.values('id', 'body', 'update_time')
+    """
+    return get_body(model, values['id'], values['update_time'], values['body'])
+
+
+def cache_body(obj):
+    """
+    保存后写入缓存，obj.body 可能是文本也可能是刚保存的 dict
+    """
+    value = parse_body(obj.body)
+    _set(get_key(type(obj), obj.pk, obj.update_time), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
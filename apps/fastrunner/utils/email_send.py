@@ -187,6 +187,9 @@ def parser_runresult(sample_summary, sensitive_keys):
                         error_response_content += error_api["attachment"] + '\n'
 
         if test["status"] == 'error':
+            if not error_response_content:
+                # 运行前出错的用例没有 details
+                error_response_content = summary.get("error", "")
             fail_task += 1
             err_msg = {}
             err_msg["proj"] = test['name']
@@ -1,30 +1,82 @@
-from urllib.parse import urlparse
-import re
+from urllib.parse import urlparse, urlunparse
+import ipaddress
+import json
 
+from fastrunner import models
 
-def parse_host(ip, api):
+"""hosts 域名解析
+    HostIP.hostInfo 中的 hosts 为 hosts 文件格式的文本或行列表：IP 域名 [域名...]，# 之后为注释
+    每次运行编译一次 HostResolver，按 url 的域名精确匹配，匹配时替换为 IP 并设置 Host 请求头
+"""
 
-    if not isinstance(ip, list):
-        return api
-    if not api:
+
+class HostResolver(object):
+    """
+    域名 -> IP 解析表，同一域名以第一次出现的为准
+    """
+
+    def __init__(self, lines=None):
+        self.hosts = {}
+        for line in lines or []:
+            fields = str(line).split('#', 1)[0].split()
+            if len(fields) < 2:
+                continue
+            try:
+                ip = ipaddress.ip_address(fields[0])
+            except ValueError:
+                continue
+            address = '[%s]' % ip if ip.version == 6 else str(ip)
+            for name in fields[1:]:
+                self.hosts.setdefault(name.lower(), address)
+
+    def __bool__(self):
+        return bool(self.hosts)
+
+    def resolve(self, api):
+        """
+        替换 api 或 config 的 url/base_url，原域名写入 Host 请求头
+        """
+        if not self.hosts or not api:
+            return api
+        request = api["request"]
+        key = "url" if "url" in request else "base_url"
+        parts = urlparse(request.get(key) or '')
+        address = self.hosts.get((parts.hostname or '').lower())
+        if not address:
+            return api
+
+        userinfo, _, host = parts.netloc.rpartition('@')
+        netloc = address if parts.port is None else '%s:%s' % (address, parts.port)
+        if userinfo:
+            netloc = '%s@%s' % (userinfo, netloc)
+        request[key] = urlunparse(parts._replace(netloc=netloc))
+        if "headers" in request.keys():
+            request["headers"]["Host"] = host
+        else:
+            request.setdefault("headers", {"Host": host})
         return api
-    try:
-        parts = urlparse(api["request"]["url"])
-    except KeyError:
-        parts = urlparse(api["request"]["base_url"])
-    host = parts.netloc
-    if host:
-        for content in ip:
-            content = content.strip()
-            if host in content and not content.startswith("#"):
-                ip = re.findall(r'\b(?:25[0-5]\.|2[0-4]\d\.|[01]?\d\d?\.){3}(?:25[0-5]|2[0-4]\d|[01]?\d\d?)\b', content)
-                if ip:
-                    if "headers" in api["request"].keys():
-                        api["request"]["headers"]["Host"] = host
-                    else:
-                        api["request"].setdefault("headers", {"Host": host})
-                    try:
-                        api["request"]["url"] = api["request"]["url"].replace(host, ip[-1])
-                    except KeyError:
-                        api["request"]["base_url"] = api["request"]["base_url"].replace(host, ip[-1])
-    return api
+
+    def resolve_all(self, apis):
+        for api in apis:
+            self.resolve(api)
+        return apis
+
+
+def compile_hosts(host):
+    """
+    host: HostIP instance、hosts 行列表或未选择环境时的字符串
+    """
+    if isinstance(host, HostResolver):
+        return host
+    if isinstance(host, models.HostIP):
+        host = json.loads(host.hostInfo).get("hosts") or []
+        if isinstance(host, str):
+            host = host.splitlines()
+    return HostResolver(host if isinstance(host, list) else [])
+
+
+def parse_host(ip, api):
+    """
+    ip: compile_hosts 的结果，传入其他值时先编译，批量处理时应只编译一次
+    """
+    return compile_hosts(ip).resolve(api)
@@ -1,26 +1,38 @@
 import copy
 import datetime
 import importlib
+import importlib.util
 import io
 import json
 import os
 import shutil
 import sys
-import tempfile
+import threading
 import types
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
 import requests
 import yaml
 import traceback
-from bs4 import BeautifulSoup
 from httprunner import HttpRunner, logger
 from requests.cookies import RequestsCookieJar
 
 from fastrunner import models
+from fastrunner.utils import workspace
+from fastrunner.utils.report import ReportWriter
+from fastrunner.utils.cache import load_body, load_body_values
 from fastrunner.utils.parser import Format
-from FasterRunner.settings import BASE_DIR
+from FasterRunner.settings import SUITE_RUN_WORKERS, SUITE_RUN_MAX_WORKERS
 
 logger.setup_logger('INFO')
 
+# 注入驱动代码模块的名称，不作为 debugtalk 函数或变量
+INJECTED_NAMES = ('open', 'WORKSPACE')
+
+_import_lock = threading.Lock()
+
 TEST_NOT_EXISTS = {
     "code": "0102",
     "status": False,
@@ -54,6 +66,17 @@ def is_variable(tup):
     return True
 
 
+def relative_open(root):
+    """ returns open() which resolves relative paths against root.
+    """
+    def _open(file, *args, **kwargs):
+        if isinstance(file, str) and not os.path.isabs(file):
+            file = os.path.join(root, file)
+        return io.open(file, *args, **kwargs)
+
+    return _open
+
+
 class FileLoader(object):
 
     @staticmethod
@@ -94,6 +117,8 @@ class FileLoader(object):
     @staticmethod
     def load_python_module(file_path):
         """ load python module.
+            以工作目录唯一的模块名加载 debugtalk.py，不同项目互不覆盖；
+            模块中的 open 按工作目录解析相对路径，调用方在 workspace.enter 中加载，其他库的相对路径同样按工作目录解析
 
         Args:
             file_path: python path
@@ -112,13 +137,33 @@ class FileLoader(object):
             "functions": {}
         }
 
-        sys.path.insert(0, file_path)
-        module = importlib.import_module("debugtalk")
-        # 修复重载bug
-        importlib.reload(module)
-        sys.path.pop(0)
+        module_name = workspace.get_module_name(file_path)
+        with _import_lock:
+            modules_before = set(sys.modules)
+            sys.path.insert(0, file_path)
+            try:
+                spec = importlib.util.spec_from_file_location(module_name, os.path.join(file_path, 'debugtalk.py'))
+                module = importlib.util.module_from_spec(spec)
+                module.open = relative_open(file_path)
+                module.WORKSPACE = file_path
+                sys.modules[module_name] = module
+                spec.loader.exec_module(module)
+            except Exception:
+                sys.modules.pop(module_name, None)
+                raise
+            finally:
+                sys.path.remove(file_path)
+                # debugtalk 引入的同目录模块不保留在 sys.modules 中，避免不同项目的同名模块互相覆盖
+                for name in set(sys.modules) - modules_before:
+                    item = sys.modules[name]
+                    if name != module_name and \
+                            (getattr(item, '__file__', None) or '').startswith(file_path + os.sep):
+                        item.open = relative_open(file_path)
+                        del sys.modules[name]
 
         for name, item in vars(module).items():
+            if name in INJECTED_NAMES:
+                continue
             if is_function((name, item)):
                 debugtalk_module["functions"][name] = item
             elif is_variable((name, item)):
@@ -131,11 +176,34 @@ class FileLoader(object):
         return debugtalk_module
 
 
-def parse_tests(testcases, debugtalk, project, name=None, config=None):
+class VariableSnapshot(object):
+    """项目全局变量快照
+        一次运行只查询一次，按 key 索引，与配置变量合并时配置变量优先
+    """
+
+    def __init__(self, project):
+        self.variables = OrderedDict(
+            models.Variables.objects.filter(project__id=project).order_by('id').values_list("key", "value"))
+
+    def merge(self, variables=None):
+        """
+        variables: list 配置变量 [{key: value}]
+        返回新列表：配置变量在前，未被覆盖的全局变量追加在后
+        """
+        merged = list(variables or [])
+        keys = set()
+        for content in merged:
+            keys.update(content.keys())
+        merged.extend({key: value} for key, value in self.variables.items() if key not in keys)
+        return merged
+
+
+def parse_tests(testcases, debugtalk, project, name=None, config=None, variables=None):
     """get test case structure
         testcases: list
         config: none or dict
         debugtalk: dict
+        variables: VariableSnapshot 同一次运行共用，未传时查询项目全局变量
     """
     refs = {
         "env": {},
@@ -169,91 +237,155 @@ def parse_tests(testcases, debugtalk, project, name=None, config=None):
     if name:
         testset["config"]["name"] = name
 
-    global_variables = []
-
-    for variables in models.Variables.objects.filter(project__id=project).values("key", "value"):
-        if testset["config"].get("variables"):
-            for content in testset["config"]["variables"]:
-                if variables["key"] not in content.keys():
-                    global_variables.append({variables["key"]: variables["value"]})
-        else:
-            global_variables.append({variables["key"]: variables["value"]})
-
-    if not testset["config"].get("variables"):
-        testset["config"]["variables"] = global_variables
-    else:
-        testset["config"]["variables"].extend(global_variables)
+    if variables is None:
+        variables = VariableSnapshot(project)
+    testset["config"]["variables"] = variables.merge(testset["config"].get("variables"))
 
     testset["config"]["refs"] = refs
 
     return testset
 
 
+def clone_testset(testset):
+    """复制用例集
+        只复制 config 与 teststeps 中的可变部分，config.refs 中的 debugtalk 函数与变量共享不复制
+    """
+    config = dict(testset["config"])
+    refs = config.pop("refs", None)
+    cloned = copy.deepcopy({"config": config, "teststeps": testset["teststeps"]})
+    if refs is not None:
+        cloned["config"]["refs"] = refs
+    return cloned
+
+
 def load_debugtalk(project):
-    """import debugtalk.py in sys.path and reload
+    """load debugtalk.py of project
         project: int
+        工作目录按项目缓存，驱动代码与测试数据没有更新时不会重新生成，也不会重复加载
     """
-    tempfile_path = tempfile.mkdtemp(prefix='tempHttpRunner', dir=os.path.join(BASE_DIR, 'tempWorkDir'))
-    debugtalk_path = os.path.join(tempfile_path, 'debugtalk.py')
-    os.chdir(tempfile_path)
     try:
-        py_files = models.Pycode.objects.filter(project__id=project)
-        for file in py_files:
-            file_path = os.path.join(tempfile_path, file.name)
-            FileLoader.dump_python_file(file_path, file.code)
-        testdata_files = models.ModelWithFileField.objects.filter(project__id=project)
-        for testdata in testdata_files:
-            testdata_path = os.path.join(tempfile_path, testdata.name)
-            myfile_path = os.path.join(BASE_DIR, 'media', str(testdata.file))
-            FileLoader.copy_file(myfile_path, testdata_path)
-        debugtalk = FileLoader.load_python_module(os.path.dirname(debugtalk_path))
-        return debugtalk, debugtalk_path
+        workspace_path = workspace.get_workspace(project)
+        debugtalk = workspace.get_module(workspace_path)
+        if debugtalk is None:
+            with workspace.enter(workspace_path):
+                debugtalk = FileLoader.load_python_module(workspace_path)
+            workspace.set_module(workspace_path, debugtalk)
+        return debugtalk, os.path.join(workspace_path, 'debugtalk.py')
     except Exception as e:
-        os.chdir(BASE_DIR)
-        shutil.rmtree(os.path.dirname(debugtalk_path))
         raise SyntaxError(str(e))
 
 
-def debug_suite(suite, project, obj, config, save=True):
+def get_workers(workers=None):
+    """并行数量，未指定时取配置 SUITE_RUN_WORKERS
+    """
+    try:
+        workers = int(workers) if workers else SUITE_RUN_WORKERS
+    except (TypeError, ValueError):
+        workers = SUITE_RUN_WORKERS
+    return max(1, min(workers, SUITE_RUN_MAX_WORKERS))
+
+
+def merge_summary(summaries):
+    """合并多次运行的summary，结构与 HttpRunner.summary 一致
+    """
+    summary = {
+        "success": all(content["success"] for content in summaries),
+        "stat": {},
+        "time": {},
+        "platform": summaries[0]["platform"],
+        "details": []
+    }
+    start_at = min(content["time"]["start_at"] for content in summaries)
+    end_at = max(content["time"]["start_at"] + content["time"]["duration"] for content in summaries)
+    summary["time"]["start_at"] = start_at
+    summary["time"]["duration"] = end_at - start_at
+
+    for content in summaries:
+        for key, value in content["stat"].items():
+            summary["stat"][key] = summary["stat"].get(key, 0) + value
+        summary["details"].extend(content["details"])
+
+    return summary
+
+
+def run_test_sets(test_sets, failfast=True, workers=1, callback=None):
+    """运行测试集
+        workers > 1 时每个用例集单独交给一个 HttpRunner，在线程池中并行执行，
+        failfast 只作用于各自的用例集，结果按 test_sets 顺序合并
+        callback: 每个用例集运行完成后调用 callback(summary, index)，返回的结果不再保留 details
+    """
+    if callback is None and (workers <= 1 or len(test_sets) <= 1):
+        runner = HttpRunner(failfast=failfast)
+        runner.run(test_sets)
+        return runner.summary
+
+    def run_test_set(index):
+        runner = HttpRunner(failfast=failfast)
+        runner.run([test_sets[index]])
+        summary = runner.summary
+        if callback is not None:
+            callback(summary, index)
+            summary = dict(summary, details=[])
+        return summary
+
+    def run_in_thread(index):
+        try:
+            return run_test_set(index)
+        finally:
+            connection.close()
+
+    if workers <= 1 or len(test_sets) <= 1:
+        summaries = [run_test_set(index) for index in range(len(test_sets))]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(test_sets))) as executor:
+            summaries = list(executor.map(run_in_thread, range(len(test_sets))))
+
+    return merge_summary(summaries)
+
+
+def debug_suite(suite, project, obj, config, save=True, workers=None, writer=None):
     """debug suite
            suite :list
            pk: int
            project: int
+           workers: int 并行执行的用例集数量
+           writer: ReportWriter 传入时每个用例集完成后立即写入报告，返回的 summary 不含 details
     """
     if len(suite) == 0:
         return TEST_NOT_EXISTS
 
     test_sets = []
-    debugtalk = load_debugtalk(project)
-    debugtalk_content = debugtalk[0]
-    debugtalk_path = debugtalk[1]
-    os.chdir(os.path.dirname(debugtalk_path))
+    debugtalk_content, debugtalk_path = load_debugtalk(project)
+    variables = VariableSnapshot(project)
     try:
-        for index in range(len(suite)):
-            testcases = copy.deepcopy(
-                parse_tests(suite[index], debugtalk_content, project, name=obj[index]['name'], config=config[index]))
-            test_sets.append(testcases)
-
-        kwargs = {
-            "failfast": True
-        }
-        runner = HttpRunner(**kwargs)
-        runner.run(test_sets)
-        summary = parse_summary(runner.summary)
+        with workspace.enter(os.path.dirname(debugtalk_path)):
+            for index in range(len(suite)):
+                testcases = clone_testset(
+                    parse_tests(suite[index], debugtalk_content, project, name=obj[index]['name'],
+                                config=config[index], variables=variables))
+                test_sets.append(testcases)
+
+            callback = None
+            if writer is not None:
+                def callback(result, index):
+                    writer.write(parse_summary(result), index=index)
+
+            summary = parse_summary(run_test_sets(test_sets, failfast=True, workers=get_workers(workers),
+                                                  callback=callback))
         if save:
             save_summary("", summary, project, type=1)
         return summary
     except Exception as e:
         raise SyntaxError(str(e))
-    finally:
-        os.chdir(BASE_DIR)
-        shutil.rmtree(os.path.dirname(debugtalk_path))
 
 
-def debug_api(api, project, name=None, config=None, save=False, test_data=None, report_name=''):
+def debug_api(api, project, name=None, config=None, save=False, test_data=None, report_name='', variables=None):
     """debug api
         api :dict or list
         project: int
+        variables: VariableSnapshot 可选，批量运行时共用
+        test_data: (excel 文件名, sheet 名) 可选，作为本次运行的配置变量 excelName/excelsheet，
+            同时保留旧的环境变量 os.environ["excelName"/"excelsheet"]（已废弃，运行期间有效）
     """
     if len(api) == 0:
         return TEST_NOT_EXISTS
@@ -268,22 +400,31 @@ def debug_api(api, project, name=None, config=None, save=False, test_data=None,
     debugtalk = load_debugtalk(project)
     debugtalk_content = debugtalk[0]
     debugtalk_path = debugtalk[1]
-    os.chdir(os.path.dirname(debugtalk_path))
-    try:
-        testcase_list = [parse_tests(api, debugtalk_content, project, name=name, config=config)]
-
-        fail_fast = False
-        if config and 'failFast' in config.keys():
-            fail_fast = True if (config["failFast"] == 'true' or config["failFast"] is True) else False
-
-        kwargs = {
-            "failfast": fail_fast
+    workspace_path = os.path.dirname(debugtalk_path)
+    environ = {}
+    if test_data is not None:
+        environ = {
+            "excelName": os.path.join(workspace_path, test_data[0]),
+            "excelsheet": test_data[1]
         }
-        if test_data is not None:
-            os.environ["excelName"] = test_data[0]
-            os.environ["excelsheet"] = test_data[1]
-        runner = HttpRunner(**kwargs)
-        runner.run(testcase_list)
+    try:
+        # 环境变量只在运行期间设置，测试数据不同的运行在同一进程内依次执行
+        with workspace.enter(workspace_path, environ):
+            testcase_list = [parse_tests(api, debugtalk_content, project, name=name, config=config,
+                                         variables=variables)]
+
+            fail_fast = False
+            if config and 'failFast' in config.keys():
+                fail_fast = True if (config["failFast"] == 'true' or config["failFast"] is True) else False
+
+            kwargs = {
+                "failfast": fail_fast
+            }
+            if environ:
+                # 驱动代码推荐通过 $excelName/$excelsheet 作为函数参数获取
+                testcase_list[0]["config"]["variables"].extend({key: value} for key, value in environ.items())
+            runner = HttpRunner(**kwargs)
+            runner.run(testcase_list)
 
         summary = parse_summary(runner.summary)
         if save:
@@ -291,9 +432,6 @@ def debug_api(api, project, name=None, config=None, save=False, test_data=None,
         return summary
     except Exception as e:
         raise SyntaxError(str(e))
-    finally:
-        os.chdir(BASE_DIR)
-        shutil.rmtree(os.path.dirname(debugtalk_path))
 
 
 def load_test(test, project=None):
@@ -318,7 +456,7 @@ def load_test(test, project=None):
             else:
                 case_step = models.API.objects.get(id=test['id'])
 
-        testcase = eval(case_step.body)
+        testcase = load_body(case_step)
         name = test['body']['name']
 
         if case_step.name != name:
@@ -327,8 +465,49 @@ def load_test(test, project=None):
     return testcase
 
 
+def load_suites(project, relation):
+    """按节点批量加载用例集
+        project: int
+        relation: list 节点id，用例按节点顺序、id 顺序返回
+        用例、步骤、配置各一次查询，逐个返回 (case, teststeps, config)
+            case: {"id": int, "name": str}
+            teststeps: list 不含配置的步骤
+            config: dict or None
+    """
+    order = {int(relation_id): index for index, relation_id in enumerate(relation)}
+    cases = list(models.Case.objects.filter(project__id=project, relation__in=list(order)).
+                 values('id', 'name', 'relation'))
+    cases.sort(key=lambda case: (order[case['relation']], case['id']))
+
+    steps = {case['id']: [] for case in cases}
+    config_names = set()
+    test_list = models.CaseStep.objects.filter(case__id__in=list(steps)).order_by('case_id', 'step'). \
+        values('id', 'case_id', 'body', 'update_time')
+    for content in test_list.iterator():
+        body = load_body_values(models.CaseStep, content)
+        if "base_url" in body["request"].keys():
+            config_names.add(body["name"])
+        steps[content['case_id']].append(body)
+
+    configs = {config.name: config for config in
+               models.Config.objects.filter(project__id=project, name__in=config_names)}
+
+    for case in cases:
+        teststeps = []
+        config = None
+        for body in steps[case['id']]:
+            if "base_url" in body["request"].keys():
+                if body["name"] not in configs:
+                    raise models.Config.DoesNotExist('指定的配置不存在:{name}'.format(name=body["name"]))
+                config = load_body(configs[body["name"]])
+                continue
+            teststeps.append(body)
+        yield {"id": case["id"], "name": case["name"]}, teststeps, config
+
+
 def parse_summary(summary):
     """序列化summary
+        text/html 响应保存原始内容，查看报告时再按项目设置格式化
     """
     for detail in summary["details"]:
 
@@ -346,10 +525,6 @@ def parse_summary(summary):
                 if isinstance(value, RequestsCookieJar):
                     record["meta_data"]["response"][key] = requests.utils.dict_from_cookiejar(value)
 
-            if "text/html" in record["meta_data"]["response"]["content_type"]:
-                record["meta_data"]["response"]["content"] = \
-                    BeautifulSoup(record["meta_data"]["response"]["content"], features="html.parser").prettify()
-
     return summary
 
 
@@ -358,26 +533,6 @@ def save_summary(name, summary, project, type=2):
     """
     if "status" in summary.keys():
         return
-    if name is "":
-        name = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    simple_summary = {
-        "time": summary["time"],
-        "platform": summary["platform"],
-        "stat": summary["stat"],
-        "success": summary["success"],
-    }
-    project_class = models.Project.objects.get(id=project)
-    report = models.Report.objects.create(**{
-        "project": project_class,
-        "name": name,
-        "type": type,
-        "summary": json.dumps(simple_summary)
-    })
-    report.save()
-    report_detail = models.ReportDetail.objects.create(**{
-        "project": project_class,
-        "name": name,
-        "report": report,
-        "summary": json.dumps(summary, ensure_ascii=False)
-    })
-    report_detail.save()
+    writer = ReportWriter.create(name, project, type=type)
+    writer.write(summary)
+    writer.finish()
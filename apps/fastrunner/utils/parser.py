@@ -1,3 +1,4 @@
+import ast
 import json
 import logging
 import traceback
@@ -382,6 +383,25 @@ class Parse(object):
         self.testcase = test
 
 
+def dumps_body(value):
+    """
+    主体信息、树形结构等统一以 JSON 文本存储
+    """
+    return json.dumps(value, ensure_ascii=False)
+
+
+def loads_body(text):
+    """
+    解析 dumps_body 存储的文本，兼容旧数据的 str(dict) 格式
+    """
+    if not isinstance(text, str):
+        return text
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
 def format_json(value):
     try:
         return json.dumps(value, indent=4, separators=(',', ': '), ensure_ascii=False)
@@ -1,13 +1,103 @@
 # -*- coding: utf-8 -*-
 from rest_framework import permissions
 from django.contrib.auth import get_user_model
+from django.core import signing
 from rest_framework import exceptions
 from rest_framework import status
 
-from fastrunner.models import LockFiles
+from fastrunner.models import LockFiles, Report
+from fastrunner.utils.cache import get_shared_cache
+from FasterRunner.settings import PROJECT_MEMBER_CACHE_BACKEND, PROJECT_MEMBER_CACHE_TIMEOUT, REPORT_SIGN_MAX_AGE
 
 UserModel = get_user_model()
 
+REPORT_SIGN_SALT = 'fastrunner.report'
+
+
+def get_member_key(user_id):
+    return 'belong_project:%s' % user_id
+
+
+def get_project_ids(request):
+    """
+    当前用户所属的项目 id 集合
+    同一请求内只查询一次，配置共享缓存时跨请求缓存 PROJECT_MEMBER_CACHE_TIMEOUT 秒，belong_project 变更时清除
+    """
+    project_ids = getattr(request, '_belong_project_ids', None)
+    if project_ids is not None:
+        return project_ids
+
+    cache = get_shared_cache(PROJECT_MEMBER_CACHE_BACKEND)
+    key = get_member_key(request.user.id)
+    project_ids = cache.get(key) if cache is not None else None
+    if project_ids is None:
+        project_ids = frozenset(UserModel.objects.filter(id=request.user.id).
+                                exclude(belong_project=None).values_list('belong_project', flat=True))
+        if cache is not None:
+            cache.set(key, project_ids, PROJECT_MEMBER_CACHE_TIMEOUT)
+    request._belong_project_ids = project_ids
+    return project_ids
+
+
+def clear_project_ids(user_ids):
+    cache = get_shared_cache(PROJECT_MEMBER_CACHE_BACKEND)
+    if cache is not None:
+        cache.delete_many([get_member_key(user_id) for user_id in user_ids])
+
+
+def check_project_member(request, project_id):
+    """
+    非超级用户不属于项目时抛出 PermissionDenied，用于按项目批量操作时整批检查一次
+    """
+    if not request.user.is_superuser and int(project_id) not in get_project_ids(request):
+        raise exceptions.PermissionDenied()
+
+
+def filter_project(request, queryset):
+    """
+    删除等按 id 操作的 queryset 限定在项目内
+    带 project 参数时只取该项目并校验成员，否则非超级用户只取所属的项目
+    """
+    project_id = request.query_params.get('project')
+    if project_id is not None:
+        check_project_member(request, project_id)
+        return queryset.filter(project__id=project_id)
+    if request.user.is_superuser:
+        return queryset
+    return queryset.filter(project__id__in=get_project_ids(request))
+
+
+def get_report_sign(report_id):
+    """
+    报告页面按需加载用的签名，REPORT_SIGN_MAX_AGE 秒内只对该报告有效，页面中不写入登录凭证
+    """
+    return signing.dumps(int(report_id), salt=REPORT_SIGN_SALT)
+
+
+def check_report_sign(sign, report_id):
+    try:
+        return signing.loads(sign, salt=REPORT_SIGN_SALT, max_age=REPORT_SIGN_MAX_AGE) == int(report_id)
+    except (signing.BadSignature, TypeError, ValueError):
+        return False
+
+
+class IsReportReadable(permissions.BasePermission):
+    """
+    报告详情的按需加载接口：带有效的 sign 参数，或登录用户属于报告所在的项目
+    """
+
+    def has_permission(self, request, view):
+        report_id = view.kwargs.get('pk')
+        sign = request.query_params.get('sign')
+        if sign and check_report_sign(sign, report_id):
+            return True
+        if not request.user or not request.user.is_authenticated:
+            return False
+        if request.user.is_superuser:
+            return True
+        project_id = Report.objects.filter(id=report_id).values_list('project_id', flat=True).first()
+        return project_id in get_project_ids(request)
+
 
 class IsBelongToProject(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -16,12 +106,11 @@ class IsBelongToProject(permissions.BasePermission):
         """
         if request.user.is_superuser:
             return True
-        project_id_list = UserModel.objects.filter(id=request.user.id).values_list('belong_project', flat=True)
         try:
             project_id = request.data['project']
         except Exception as e:
             project_id = request.query_params['project']
-        if int(project_id) in [_ for _ in project_id_list]:
+        if int(project_id) in get_project_ids(request):
             return True
         return False
 
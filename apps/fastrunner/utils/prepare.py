@@ -1,8 +1,15 @@
 # _*_ coding: utf-8 _*_
+import datetime
 import json
+from django.db import transaction
+from django.db.models import Case, When, Value, Count, IntegerField, Subquery
+from django.db.models.functions import Coalesce
 from fastrunner import models
-from fastrunner.utils.parser import Format
+from fastrunner.utils import search, tree
+from fastrunner.utils.cache import load_body, get_shared_cache
+from fastrunner.utils.parser import Format, dumps_body
 from djcelery import models as celery_models
+from FasterRunner.settings import PROJECT_DETAIL_CACHE_BACKEND, PROJECT_DETAIL_CACHE_TIMEOUT
 
 
 def get_counter(model, pk=None):
@@ -15,55 +22,194 @@ def get_counter(model, pk=None):
         return model.objects.count()
 
 
-def get_project_detail(pk):
+def count_subquery(queryset, group):
+    """
+    统计子查询，没有数据时为 0
+    """
+    return Coalesce(Subquery(queryset.order_by().values(group).annotate(count=Count('id')).values('count'),
+                             output_field=IntegerField()), 0)
+
+
+def count_project_detail(pk):
+    """
+    一次查询统计项目下各表数量
     """
-    项目详细统计信息
-    """
-    api_count = get_counter(models.API, pk=pk)
-    case_count = get_counter(models.Case, pk=pk)
-    config_count = get_counter(models.Config, pk=pk)
-    variables_count = get_counter(models.Variables, pk=pk)
-    report_count = get_counter(models.Report, pk=pk)
-    host_count = get_counter(models.HostIP, pk=pk)
-    task_count = celery_models.PeriodicTask.objects.filter(description=pk).count()
-
-    return {
-        "api_count": api_count,
-        "case_count": case_count,
-        "task_count": task_count,
-        "config_count": config_count,
-        "variables_count": variables_count,
-        "report_count": report_count,
-        "host_count":host_count
+    counters = {
+        "api_count": count_subquery(models.API.objects.filter(project_id=pk), 'project'),
+        "case_count": count_subquery(models.Case.objects.filter(project_id=pk), 'project'),
+        "task_count": count_subquery(celery_models.PeriodicTask.objects.filter(description=pk), 'description'),
+        "config_count": count_subquery(models.Config.objects.filter(project_id=pk), 'project'),
+        "variables_count": count_subquery(models.Variables.objects.filter(project_id=pk), 'project'),
+        "report_count": count_subquery(models.Report.objects.filter(project_id=pk), 'project'),
+        "host_count": count_subquery(models.HostIP.objects.filter(project_id=pk), 'project'),
     }
+    detail = models.Project.objects.filter(id=pk).annotate(**counters).values(*counters).first()
+    return detail or dict.fromkeys(counters, 0)
+
+
+def get_project_detail_key(pk):
+    return 'project_detail:%s' % pk
+
+
+def get_project_detail(pk):
+    """
+    项目详细统计信息，配置共享缓存时缓存 PROJECT_DETAIL_CACHE_TIMEOUT 秒，相关数据写入或删除时清除
+    """
+    cache = get_shared_cache(PROJECT_DETAIL_CACHE_BACKEND)
+    if cache is None:
+        return count_project_detail(pk)
+    key = get_project_detail_key(pk)
+    detail = cache.get(key)
+    if detail is None:
+        detail = count_project_detail(pk)
+        cache.set(key, detail, PROJECT_DETAIL_CACHE_TIMEOUT)
+    return dict(detail)
+
+
+def clear_project_detail(pk):
+    """
+    清除项目统计缓存，批量写入或删除等不触发 signals 的地方需要显式调用
+    """
+    cache = get_shared_cache(PROJECT_DETAIL_CACHE_BACKEND)
+    if cache is not None:
+        cache.delete(get_project_detail_key(pk))
 
 
-def tree_end(params, project):
+def tree_end(params, project, node_ids=None):
     """
+    删除节点及全部子孙节点下的接口或用例，返回删除数量
     project: Project Model
     params: {
         node: int,
         type: int
     }
+    node_ids: 已计算好的节点及子孙节点 id，节点已从树中移除时由调用方在移除前计算
+    """
+    type = int(params['type'])
+    if node_ids is None:
+        relation = tree.get_relation(project.id, type)
+        node_ids = tree.get_descendants(relation, int(params['node']))
+    return nodes_end(node_ids, type, project)
+
+
+def nodes_end(node_ids, type, project):
+    """
+    一个事务内删除挂在 node_ids 上的接口或用例及其步骤，接口与单个删除一样同时删除引用它的用例步骤
+    """
+    counts = {}
+    with transaction.atomic():
+        if type == 1:
+            api_ids = list(models.API.objects.filter(project=project, relation__in=node_ids).
+                           values_list('id', flat=True))
+            step_count = models.CaseStep.objects.filter(apiId__in=api_ids).count()
+            if api_ids:
+                apis_end(api_ids)
+            counts = {"api": len(api_ids), "step": step_count}
+
+        # remove node testcase
+        elif type == 2:
+            case_ids = list(models.Case.objects.filter(project=project, relation__in=node_ids).
+                            values_list('id', flat=True))
+            step_count = models.CaseStep.objects.filter(case_id__in=case_ids).count()
+            if case_ids:
+                cases_end(case_ids, project.id)
+            counts = {"case": len(case_ids), "step": step_count}
+    clear_project_detail(project.id)
+    return counts
+
+
+def clean_orphans(project, type, dry_run=False):
+    """
+    清理挂在已不存在节点上的接口或用例，返回 {"nodes": 孤立的节点 id, 删除数量...}
+    树为空时不处理，避免节点导入异常时误删全部数据
+    树不存在或节点尚未导入的项目跳过，不创建默认树，dry_run 与实际清理的结果一致
+    """
+    model = models.API if type == 1 else models.Case if type == 2 else None
+    if model is None:
+        return {"nodes": []}
+
+    relation = models.Relation.objects.filter(project=project, type=type).first()
+    if relation is None or relation.max_id is None:
+        return {"nodes": []}
+    node_ids = set(tree.get_nodes(relation).values_list('node_id', flat=True))
+    if not node_ids:
+        return {"nodes": []}
+
+    orphan_nodes = sorted(set(model.objects.filter(project=project).exclude(relation__in=node_ids).
+                              values_list('relation', flat=True)))
+    if dry_run or not orphan_nodes:
+        key = "api" if type == 1 else "case"
+        counts = {key: model.objects.filter(project=project, relation__in=orphan_nodes).count()}
+    else:
+        counts = nodes_end(orphan_nodes, type, project)
+    return dict(counts, nodes=orphan_nodes)
+
+
+BULK_BATCH_SIZE = 500
+
+
+def get_bulk(bulk, pk, model):
     """
-    type = params['type']
-    node = params['node']
+    从 in_bulk 结果中取值，不存在时与 objects.get 一样抛出 DoesNotExist
+    """
+    try:
+        return bulk[pk]
+    except KeyError:
+        raise model.DoesNotExist('%s matching query does not exist.' % model._meta.object_name)
 
-    if type == 1:
-        models.API.objects.filter(relation=node, project=project).delete()
 
-    # remove node testcase
-    elif type == 2:
-        case = models.Case.objects.filter(relation=node, project=project).values('id')
+def bulk_update(model, objs, fields, batch_size=BULK_BATCH_SIZE):
+    """
+    Django 2.1 没有 QuerySet.bulk_update，使用 CASE WHEN 每批一条 UPDATE
+    """
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        values = {}
+        for field in fields:
+            output_field = model._meta.get_field(field)
+            values[field] = Case(*[When(pk=obj.pk, then=Value(getattr(obj, field), output_field=output_field))
+                                   for obj in batch], output_field=output_field)
+        model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**values)
 
-        for case_id in case:
-            models.CaseStep.objects.filter(case__id=case_id['id']).delete()
-            models.Case.objects.filter(id=case_id['id']).delete()
+
+def merge_api_body(new_body, api_body):
+    """
+    用例步骤的 request 以及 header/data/files/params 描述取自 api
+    """
+    new_body["request"] = api_body["request"]
+    new_body["desc"]["header"] = api_body["desc"]["header"]
+    new_body["desc"]["data"] = api_body["desc"]["data"]
+    new_body["desc"]["files"] = api_body["desc"]["files"]
+    new_body["desc"]["params"] = api_body["desc"]["params"]
 
 
 def update_casestep(body, case):
-    step_list = list(models.CaseStep.objects.filter(case=case).values('id'))
+    """
+    更新用例集步骤，引用的 step/api/config 一次查出，新增、更新、删除各批量执行
+    step 只在当前用例中查找，其他用例的 step id 按不存在处理
+    """
+    step_ids = set(models.CaseStep.objects.filter(case=case).values_list('id', flat=True))
+    case_steps = models.CaseStep.objects.filter(case=case). \
+        in_bulk([test['id'] for test in body if 'case' in test.keys()])
+
+    api_ids = []
+    config_names = []
+    for test in body:
+        if 'case' in test.keys():
+            case_step = get_bulk(case_steps, test['id'], models.CaseStep)
+            if 'newBody' in test.keys() or case_step.method != "config":
+                api_ids.append(case_step.apiId)
+        elif 'newBody' in test.keys() or test["body"]["method"] != "config":
+            api_ids.append(test['id'])
+        else:
+            config_names.append(test['body']['name'])
+    apis = models.API.objects.in_bulk(api_ids)
+    configs = {config.name: config for config in
+               models.Config.objects.filter(project=case.project, name__in=config_names)}
 
+    update_time = datetime.datetime.now()
+    update_steps = []
+    create_steps = []
     for index in range(len(body)):
         test = body[index]
         if 'newBody' in test.keys():
@@ -72,48 +218,37 @@ def update_casestep(body, case):
             name = format_http.name
             new_body = format_http.testcase
             if 'case' in test.keys():
-                case_step = models.CaseStep.objects.get(id=test['id'])
-                api_id = case_step.apiId
+                api_id = case_steps[test['id']].apiId
             else:
                 api_id = test['id']
-            api = models.API.objects.get(id=api_id)
+            api = get_bulk(apis, api_id, models.API)
             url = api.url
             method = api.method
-            api_body = eval(api.body)
-            new_body["request"] = api_body["request"]
-            new_body["desc"]["header"] = api_body["desc"]["header"]
-            new_body["desc"]["data"] = api_body["desc"]["data"]
-            new_body["desc"]["files"] = api_body["desc"]["files"]
-            new_body["desc"]["params"] = api_body["desc"]["params"]
+            merge_api_body(new_body, load_body(api))
 
         else:
             if 'case' in test.keys():
-                case_step = models.CaseStep.objects.get(id=test['id'])
-                new_body = eval(case_step.body)
+                case_step = case_steps[test['id']]
+                new_body = load_body(case_step)
                 if case_step.method != "config":
                     api_id = case_step.apiId
-                    api = models.API.objects.get(id=api_id)
-                    api_body = eval(api.body)
+                    api = get_bulk(apis, api_id, models.API)
                     url = api.url
                     method = api.method
-                    new_body["request"] = api_body["request"]
-                    new_body["desc"]["header"] = api_body["desc"]["header"]
-                    new_body["desc"]["data"] = api_body["desc"]["data"]
-                    new_body["desc"]["files"] = api_body["desc"]["files"]
-                    new_body["desc"]["params"] = api_body["desc"]["params"]
+                    merge_api_body(new_body, load_body(api))
                 else:
                     url = ""
                     method = "config"
                     api_id = 0
             elif test["body"]["method"] == "config":
-                case_step = models.Config.objects.get(name=test['body']['name'])
-                new_body = eval(case_step.body)
+                case_step = get_bulk(configs, test['body']['name'], models.Config)
+                new_body = load_body(case_step)
                 url = ""
                 method = "config"
                 api_id = 0
             else:
-                case_step = models.API.objects.get(id=test['id'])
-                new_body = eval(case_step.body)
+                case_step = get_bulk(apis, test['id'], models.API)
+                new_body = load_body(case_step)
                 url = case_step.url
                 method = case_step.method
                 api_id = case_step.id
@@ -123,22 +258,29 @@ def update_casestep(body, case):
 
         kwargs = {
             "name": name,
-            "body": new_body,
+            "body": dumps_body(new_body),
             "url": url,
             "method": method,
             "step": index,
             "apiId": api_id
         }
         if 'case' in test.keys():
-            models.CaseStep.objects.filter(id=test['id']).update(**kwargs)
-            step_list.remove({"id": test['id']})
+            step = case_steps[test['id']]
+            for key, value in kwargs.items():
+                setattr(step, key, value)
+            step.update_time = update_time
+            update_steps.append(step)
+            step_ids.discard(test['id'])
         else:
-            kwargs['case'] = case
-            models.CaseStep.objects.create(**kwargs)
+            create_steps.append(models.CaseStep(case=case, **kwargs))
 
-    #  去掉多余的step
-    for content in step_list:
-        models.CaseStep.objects.filter(id=content['id']).delete()
+    with transaction.atomic():
+        bulk_update(models.CaseStep, update_steps, ["name", "body", "url", "method", "step", "apiId", "update_time"])
+        models.CaseStep.objects.bulk_create(create_steps, batch_size=BULK_BATCH_SIZE)
+        #  去掉多余的step
+        if step_ids:
+            models.CaseStep.objects.filter(id__in=step_ids).delete()
+    search.index_case_on_commit(case.id)
 
 
 def generate_casestep(body, case):
@@ -149,10 +291,16 @@ def generate_casestep(body, case):
         project: int,
         name: str
     }]
-
+    引用的 api/config 一次查出，步骤批量写入
     """
-    #  index也是case step的执行顺序
+    apis = models.API.objects.in_bulk([test['id'] for test in body
+                                       if 'newBody' in test.keys() or test["body"]["method"] != "config"])
+    configs = {config.name: config for config in models.Config.objects.filter(
+        project=case.project, name__in=[test["body"]["name"] for test in body
+                                        if 'newBody' not in test.keys() and test["body"]["method"] == "config"])}
 
+    #  index也是case step的执行顺序
+    steps = []
     for index in range(len(body)):
 
         test = body[index]
@@ -163,37 +311,32 @@ def generate_casestep(body, case):
             new_body = format_http.testcase
 
             apiId = test['id']
-            api = models.API.objects.get(id=apiId)
+            api = get_bulk(apis, apiId, models.API)
             url = api.url
             method = api.method
             new_body['name'] = name
-            api_body = eval(api.body)
-            new_body["request"] = api_body["request"]
-            new_body["desc"]["header"] = api_body["desc"]["header"]
-            new_body["desc"]["data"] = api_body["desc"]["data"]
-            new_body["desc"]["files"] = api_body["desc"]["files"]
-            new_body["desc"]["params"] = api_body["desc"]["params"]
+            merge_api_body(new_body, load_body(api))
 
         except KeyError:
             if test["body"]["method"] == "config":
                 name = test["body"]["name"]
                 method = test["body"]["method"]
-                config = models.Config.objects.get(name=name, project=case.project)
+                config = get_bulk(configs, name, models.Config)
                 url = config.base_url
-                new_body = eval(config.body)
+                new_body = load_body(config)
                 apiId = 0
             else:
                 apiId = test['id']
-                api = models.API.objects.get(id=apiId)
+                api = get_bulk(apis, apiId, models.API)
                 url = api.url
                 method = api.method
-                new_body = eval(api.body)
+                new_body = load_body(api)
                 name = test['body']['name']
                 new_body['name'] = name
 
         kwargs = {
             "name": name,
-            "body": new_body,
+            "body": dumps_body(new_body),
             "url": url,
             "method": method,
             "step": index,
@@ -201,26 +344,66 @@ def generate_casestep(body, case):
             "apiId": apiId
         }
 
-        models.CaseStep.objects.create(**kwargs)
+        steps.append(models.CaseStep(**kwargs))
+
+    with transaction.atomic():
+        models.CaseStep.objects.bulk_create(steps, batch_size=BULK_BATCH_SIZE)
+    search.index_case_on_commit(case.id)
+
+
+def filter_ids(queryset, data):
+    """批量删除时一次查询校验 id
+        data: [{id: int}]
+        返回 (queryset 中存在的 id, 不存在的 id)
+    """
+    ids = {int(content['id']) for content in data}
+    found = set(queryset.filter(id__in=ids).values_list('id', flat=True))
+    return sorted(found), sorted(ids - found)
+
+
+def cases_end(pks, project_id):
+    """
+    pks: [int] case id，一个事务内删除用例、步骤及定时任务里的引用
+    """
+    pks = set(pks)
+    with transaction.atomic():
+        # 删除定时任务里的case
+        tasks = celery_models.PeriodicTask.objects.select_for_update().filter(description=project_id)
+        for task in tasks:
+            task_args = json.loads(task.args)
+            remain_args = [arg for arg in task_args if arg["id"] not in pks]
+            if len(remain_args) != len(task_args):
+                task.args = json.dumps(remain_args)
+                task.save()
+        models.CaseStep.objects.filter(case_id__in=pks).delete()
+        models.Case.objects.filter(id__in=pks).delete()
+    search.remove(search.KIND_CASE, pks)
+    clear_project_detail(project_id)
 
 
 def case_end(pk, project_id):
     """
     pk: int case id
     """
-    # 删除定时任务里的case
-    tasks = celery_models.PeriodicTask.objects.filter(description=project_id)
-    for task in tasks:
-        task_args = json.loads(task.args)
-        for index in range(len(task_args)):
-            if task_args[index]["id"] == pk:
-                del task_args[index]
-        task.args = json.dumps(task_args)
-        task.save()
-    models.CaseStep.objects.filter(case__id=pk).delete()
-    models.Case.objects.filter(id=pk).delete()
+    cases_end([pk], project_id)
+
+
+def apis_end(pks):
+    """
+    pks: [int] api id，一个事务内删除接口及引用它的用例步骤，被引用的用例重建索引
+    """
+    with transaction.atomic():
+        case_ids = list(models.CaseStep.objects.filter(apiId__in=pks).values_list('case_id', flat=True).distinct())
+        project_ids = set(models.API.objects.filter(id__in=pks).values_list('project_id', flat=True))
+        models.CaseStep.objects.filter(apiId__in=pks).delete()
+        models.API.objects.filter(id__in=pks).delete()
+    for project_id in project_ids:
+        clear_project_detail(project_id)
+    search.remove(search.KIND_API, pks)
+    search.index_cases(case_ids)
 
 
 def api_end(pk):
-    models.CaseStep.objects.filter(apiId=pk).delete()
-    models.API.objects.get(id=pk).delete()
+    if not models.API.objects.filter(id=pk).exists():
+        raise models.API.DoesNotExist
+    apis_end([pk])
@@ -0,0 +1,403 @@
+# _*_ coding: utf-8 _*_
+import base64
+import datetime
+import gzip
+import json
+import os
+import time
+import zlib
+
+from bs4 import BeautifulSoup
+from django.db import transaction
+
+from fastrunner import models
+from fastrunner.utils import blob
+from FasterRunner.settings import REPORT_COMPRESS_LEVEL, REPORT_COMPRESS_MIN_SIZE, REPORT_HTML_MAX_BYTES, \
+    REPORT_BODY_MAX_SIZE, REPORT_ARCHIVE_ROOT
+
+"""测试报告增量保存
+    运行开始时创建状态为运行中的 Report，finish 时改为已完成，每个用例集运行完成后写入 ReportCase 并累加 Report.summary 中的 stat，
+    运行中断时已经完成的用例仍然保留
+    存储结构：Report -> ReportCase(用例) -> ReportStep(步骤记录)，请求体与响应内容单独存放在 ReportBody
+    详情文本超过 REPORT_COMPRESS_MIN_SIZE 时以 zlib 压缩，base64 编码后加上 COMPRESS_MARKER 前缀保存
+    请求体与响应内容超过 REPORT_BODY_MAX_SIZE 时存入 blob 文件存储，ReportBody 中只保存引用
+"""
+COMPRESS_MARKER = 'zlib:'
+
+
+def compress_text(text):
+    """
+    压缩文本，过短、已压缩或压缩后没有变小时原样返回
+    """
+    if not text or len(text) < REPORT_COMPRESS_MIN_SIZE or text.startswith(COMPRESS_MARKER):
+        return text
+    compressed = COMPRESS_MARKER + base64.b64encode(
+        zlib.compress(text.encode('utf-8'), REPORT_COMPRESS_LEVEL)).decode('ascii')
+    return compressed if len(compressed) < len(text) else text
+
+
+def decompress_text(text):
+    """
+    还原 compress_text 的结果，未压缩的文本原样返回
+    """
+    if text and text.startswith(COMPRESS_MARKER):
+        return zlib.decompress(base64.b64decode(text[len(COMPRESS_MARKER):])).decode('utf-8')
+    return text
+
+
+def dumps(value):
+    return compress_text(json.dumps(value, ensure_ascii=False))
+
+
+def loads(text):
+    return json.loads(decompress_text(text))
+
+
+def dump_content(value):
+    """
+    请求体或响应内容转为保存的文本，过大时存入文件并返回引用
+    """
+    text = json.dumps(value, ensure_ascii=False)
+    if len(text) > REPORT_BODY_MAX_SIZE:
+        return blob.save_blob(text)
+    return compress_text(text)
+
+
+def load_content(text, blobs=True):
+    """
+    还原 dump_content 的结果，blobs 为 False 时文件中的内容不读取，直接返回引用
+    """
+    if blob.is_blob(text):
+        return json.loads(blob.load_blob(text)) if blobs else text
+    return loads(text)
+
+
+def resolve_content(value):
+    """
+    load_content(blobs=False) 得到的引用按需读取，其他值原样返回
+    """
+    if blob.is_blob(value):
+        return json.loads(blob.load_blob(value))
+    return value
+
+
+def get_simple_summary(start_at=None):
+    """
+    Report.summary 初始内容
+    """
+    return {
+        "time": {
+            "start_at": time.time() if start_at is None else start_at,
+            "duration": 0
+        },
+        "platform": {},
+        "stat": {},
+        "success": True
+    }
+
+
+class ReportWriter(object):
+    """增量写入报告
+        多个线程或多个 celery 任务可以同时写入同一份报告，累加在数据库行锁内完成
+    """
+
+    def __init__(self, report_id):
+        self.report_id = report_id
+
+    @classmethod
+    def create(cls, name, project, type=2):
+        """
+        创建空报告，name 为空时使用当前时间，写入用例前结果未知
+        """
+        if not name:
+            name = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        report = models.Report.objects.create(**{
+            "project_id": project,
+            "name": name,
+            "type": type,
+            "summary": json.dumps(get_simple_summary()),
+            "success": None,
+            "status": 0
+        })
+        return cls(report.id)
+
+    def write(self, summary, index=None):
+        """写入一次运行的结果
+            summary: parse_summary 之后的 summary
+            index: 用例集序号，同一序号内按写入顺序排列
+        """
+        if "status" in summary.keys():
+            return
+
+        with transaction.atomic():
+            report = models.Report.objects.select_for_update().get(id=self.report_id)
+            if index is None:
+                index = models.ReportCase.objects.filter(report_id=self.report_id).count()
+
+            for detail in summary["details"]:
+                save_case(self.report_id, index, detail)
+
+            simple_summary = json.loads(report.summary)
+            for key, value in summary["stat"].items():
+                simple_summary["stat"][key] = simple_summary["stat"].get(key, 0) + value
+            simple_summary["success"] = simple_summary["success"] and summary["success"]
+            simple_summary["platform"] = summary["platform"] or simple_summary["platform"]
+
+            start_at = simple_summary["time"]["start_at"]
+            end_at = summary["time"]["start_at"] + summary["time"]["duration"]
+            simple_summary["time"]["duration"] = max(simple_summary["time"]["duration"], end_at - start_at)
+
+            report.summary = json.dumps(simple_summary)
+            report.success = simple_summary["success"]
+            report.save(update_fields=["summary", "success", "update_time"])
+
+    def finish(self, error=None):
+        """运行结束，耗时记为从创建报告到现在，状态改为已完成
+            error: 运行异常时传入，报告记为失败，异常信息保存在 summary 的 error 中
+        """
+        with transaction.atomic():
+            report = models.Report.objects.select_for_update().get(id=self.report_id)
+            simple_summary = json.loads(report.summary)
+            simple_summary["time"]["duration"] = time.time() - simple_summary["time"]["start_at"]
+            if error is not None:
+                simple_summary["success"] = False
+                simple_summary["error"] = str(error)
+                report.success = False
+            report.summary = json.dumps(simple_summary)
+            report.status = 1
+            report.save(update_fields=["summary", "success", "status", "update_time"])
+
+
+def split_record(record):
+    """拆分步骤记录
+        返回 (不含请求体与响应内容的 record, request_body, response_content)，内容由 dump_content 转换
+    """
+    meta_data = dict(record.get("meta_data", {}))
+    request = dict(meta_data.get("request", {}))
+    response = dict(meta_data.get("response", {}))
+    request_body = dump_content(request.pop("body", None))
+    response_content = dump_content(response.pop("content", None))
+    meta_data["request"] = request
+    meta_data["response"] = response
+    return dict(record, meta_data=meta_data), request_body, response_content
+
+
+def save_case(report_id, index, detail):
+    """
+    保存一个用例的详情、步骤记录及内容
+    """
+    records = detail.get("records", [])
+    case = models.ReportCase.objects.create(**{
+        "report_id": report_id,
+        "name": detail["name"],
+        "index": index,
+        "success": detail["success"],
+        "summary": dumps(dict(detail, records=[]))
+    })
+
+    steps = []
+    bodies = []
+    for step_index, record in enumerate(records):
+        record, request_body, response_content = split_record(record)
+        response = record["meta_data"]["response"]
+        steps.append(models.ReportStep(**{
+            "case": case,
+            "index": step_index,
+            "name": str(record.get("name", ""))[:255],
+            "status": record.get("status", ""),
+            "elapsed_ms": response.get("elapsed_ms") or response.get("response_time_ms") or 0,
+            "summary": dumps(record)
+        }))
+        bodies.append(models.ReportBody(**{
+            "case": case,
+            "index": step_index,
+            "request_body": request_body,
+            "response_content": response_content
+        }))
+    models.ReportStep.objects.bulk_create(steps)
+    models.ReportBody.objects.bulk_create(bodies)
+    return case
+
+
+def merge_body(record, body, blobs=True):
+    """
+    把 ReportBody 的内容放回步骤记录
+    """
+    record["meta_data"]["request"]["body"] = load_content(body.request_body, blobs)
+    record["meta_data"]["response"]["content"] = load_content(body.response_content, blobs)
+    return record
+
+
+def load_case_detail(case, bodies=True):
+    """返回单个用例的详情
+        case: ReportCase instance
+        bodies: False 时不加载请求体与响应内容
+    """
+    detail = loads(case.summary)
+    if detail.get("records"):
+        return detail
+
+    records = [loads(content) for content in
+               models.ReportStep.objects.filter(case=case).order_by('index').values_list('summary', flat=True)]
+    if bodies:
+        for body in models.ReportBody.objects.filter(case=case).order_by('index'):
+            merge_body(records[body.index], body)
+    detail["records"] = records
+    return detail
+
+
+def load_case_page(case, start, limit):
+    """返回单个用例的详情，步骤记录只取 [start, start + limit)，不含请求体与响应内容
+        count: 步骤总数
+    """
+    detail = loads(case.summary)
+    records = detail.get("records")
+    if records:
+        detail["count"] = len(records)
+        detail["records"] = records[start:start + limit]
+        return detail
+
+    steps = models.ReportStep.objects.filter(case=case)
+    detail["count"] = steps.count()
+    detail["records"] = [loads(content) for content in
+                         steps.order_by('index').values_list('summary', flat=True)[start:start + limit]]
+    return detail
+
+
+def load_step_body(case, index):
+    """
+    返回单个步骤的请求体、响应内容及响应类型
+    """
+    body = models.ReportBody.objects.get(case=case, index=index)
+    record = loads(models.ReportStep.objects.get(case=case, index=index).summary)
+    return {
+        "request_body": load_content(body.request_body),
+        "response_content": load_content(body.response_content),
+        "content_type": record["meta_data"]["response"].get("content_type")
+    }
+
+
+def format_content(content, content_type, prettify=False, link=None):
+    """查看报告时格式化 text/html 响应
+        prettify: 项目设置 report_prettify
+        超过 REPORT_HTML_MAX_BYTES 时截断，link 为完整内容的地址
+    """
+    if not isinstance(content, str) or "text/html" not in (content_type or ""):
+        return content
+
+    size = len(content.encode('utf-8'))
+    if size > REPORT_HTML_MAX_BYTES:
+        content = content.encode('utf-8')[:REPORT_HTML_MAX_BYTES].decode('utf-8', 'ignore')
+        content += '\n... 内容过长已截断，共 %s 字节' % size
+        if link:
+            content += '，完整内容: %s' % link
+        return content
+
+    if prettify:
+        content = BeautifulSoup(content, features="html.parser").prettify()
+    return content
+
+
+def format_summary(summary, prettify=False):
+    """
+    格式化 summary 中所有 text/html 响应
+    """
+    for detail in summary["details"]:
+        for record in detail["records"]:
+            response = record["meta_data"]["response"]
+            if "content" in response:
+                response["content"] = format_content(response["content"], response.get("content_type"), prettify)
+    return summary
+
+
+def load_report_summary(report, blobs=True):
+    """返回报告完整的 summary
+        report: Report instance
+        blobs: False 时存入文件的内容保留为引用，使用方通过 resolve_content 按需读取
+        增量保存的报告由 ReportCase/ReportStep/ReportBody 组装，旧报告读取 ReportDetail，已归档的报告读取归档文件
+        还没有写入用例的报告返回 details 为空的 summary
+    """
+    if report.archive:
+        return load_archive(report)
+
+    details = load_details(report, blobs)
+    if not details:
+        detail = models.ReportDetail.objects.filter(report=report).first()
+        if detail is not None:
+            return loads(detail.summary)
+
+    summary = json.loads(report.summary)
+    summary["details"] = [detail for index, detail in details]
+    return summary
+
+
+def load_details(report, blobs=True):
+    """
+    返回增量保存的用例详情 [(用例集序号, detail)]，按序号排列
+    """
+    cases = list(models.ReportCase.objects.filter(report=report).order_by('index', 'id'))
+    if not cases:
+        return []
+
+    records = {}
+    for case_id, content in models.ReportStep.objects.filter(case__report=report). \
+            order_by('case_id', 'index').values_list('case_id', 'summary').iterator():
+        records.setdefault(case_id, []).append(loads(content))
+    for body in models.ReportBody.objects.filter(case__report=report).iterator():
+        merge_body(records[body.case_id][body.index], body, blobs)
+
+    details = []
+    for case in cases:
+        detail = loads(case.summary)
+        if not detail.get("records"):
+            detail["records"] = records.get(case.id, [])
+        details.append((case.index, detail))
+    return details
+
+
+def load_run_summaries(report_id, results):
+    """定时任务汇总时还原每条用例的 summary
+        results: schedule_debug_cases 返回的简要结果，details 按 index 从报告中读取，运行前出错的用例没有 details
+    """
+    details = {}
+    for index, detail in load_details(models.Report.objects.get(id=report_id)):
+        details.setdefault(index, []).append(detail)
+
+    summaries = []
+    for result in results:
+        summary = {key: value for key, value in result.items() if key != "index"}
+        summary["details"] = details.get(result["index"], [])
+        summaries.append(summary)
+    return summaries
+
+
+def archive_report(report):
+    """归档报告详情
+        完整 summary 写入 REPORT_ARCHIVE_ROOT/<project>/<report>.json.gz 后删除数据库中的详情，Report 行保留
+    """
+    summary = load_report_summary(report)
+    relative_path = os.path.join(str(report.project_id), '%s.json.gz' % report.id)
+    path = os.path.join(REPORT_ARCHIVE_ROOT, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as stream:
+        json.dump(summary, stream, ensure_ascii=False)
+
+    with transaction.atomic():
+        delete_details([report.id])
+        models.Report.objects.filter(id=report.id).update(archive=relative_path)
+    report.archive = relative_path
+
+
+def load_archive(report):
+    with gzip.open(os.path.join(REPORT_ARCHIVE_ROOT, report.archive), 'rt', encoding='utf-8') as stream:
+        return json.load(stream)
+
+
+def delete_details(report_ids):
+    """
+    删除报告详情，子表先删，避免级联删除逐行加载
+    """
+    models.ReportBody.objects.filter(case__report_id__in=report_ids).delete()
+    models.ReportStep.objects.filter(case__report_id__in=report_ids).delete()
+    models.ReportCase.objects.filter(report_id__in=report_ids).delete()
+    models.ReportDetail.objects.filter(report_id__in=report_ids).delete()
@@ -52,6 +52,36 @@ TREE_UPDATE_SUCCESS = {
     "msg": "树形结构更新成功"
 }
 
+TREE_NODE_NOT_EXISTS = {
+    "code": "0023",
+    "success": False,
+    "msg": "节点不存在"
+}
+
+TREE_NODE_MOVE_ERROR = {
+    "code": "0024",
+    "success": False,
+    "msg": "不能移动到自身或子节点下"
+}
+
+TREE_DELETE_SUCCESS = {
+    "code": "0025",
+    "success": True,
+    "msg": "节点删除成功"
+}
+
+TREE_VERSION_CONFLICT = {
+    "code": "0026",
+    "success": False,
+    "msg": "树形结构已被其他人修改，请刷新后重试"
+}
+
+TREE_NODE_DUPLICATE = {
+    "code": "0027",
+    "success": False,
+    "msg": "节点ID重复"
+}
+
 FILE_UPLOAD_SUCCESS = {
     'code': '0031',
     'success': True,
@@ -298,6 +328,18 @@ REPORT_NOT_EXISTS = {
     "msg": "指定的报告不存在"
 }
 
+REPORT_CASE_NOT_EXISTS = {
+    "code": "0603",
+    "success": False,
+    "msg": "指定的报告用例或步骤不存在"
+}
+
+SEARCH_KIND_ERROR = {
+    "code": "0701",
+    "success": False,
+    "msg": "搜索类型只能是 api、case、config"
+}
+
 PYCODE_EXISTS = {
     "code": "0300",
     "success": False,
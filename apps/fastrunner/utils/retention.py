@@ -0,0 +1,122 @@
+# _*_ coding: utf-8 _*_
+import datetime
+import os
+import time
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from fastrunner import models
+from fastrunner.utils import blob
+from fastrunner.utils.report import archive_report, delete_details
+from FasterRunner.settings import REPORT_RETENTION_BATCH
+
+"""测试报告保留与归档
+    按项目的 ReportRetention 删除过期报告、归档旧报告详情，每批 REPORT_RETENTION_BATCH 条一个事务，避免长时间锁表
+"""
+
+
+def get_policy(project_id):
+    """
+    项目的保留策略，未设置时使用默认值
+    """
+    policy = models.ReportRetention.objects.filter(project_id=project_id).first()
+    return policy or models.ReportRetention(project_id=project_id)
+
+
+def get_expired(project_id, policy, now):
+    """
+    最近 keep_count 条之外、超过保留天数的报告，失败或结果未知的报告按 keep_failure_days 处理
+    """
+    reports = models.Report.objects.filter(project_id=project_id)
+    boundary = list(reports.order_by('-id').values_list('id', flat=True)[policy.keep_count:policy.keep_count + 1])
+    conditions = Q()
+    if policy.keep_days:
+        conditions |= Q(success=True, create_time__lt=now - datetime.timedelta(days=policy.keep_days))
+    if policy.keep_failure_days:
+        conditions |= (Q(success=False) | Q(success__isnull=True)) & \
+                      Q(create_time__lt=now - datetime.timedelta(days=policy.keep_failure_days))
+    if not boundary or not conditions:
+        return reports.none()
+    return reports.filter(conditions, id__lte=boundary[0])
+
+
+def delete_reports(queryset):
+    """
+    分批删除报告，返回删除数量
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:REPORT_RETENTION_BATCH])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            delete_details(ids)
+            models.Report.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def archive_reports(project_id, policy, now):
+    """
+    归档超过 archive_days 的报告详情，返回归档数量
+    """
+    if not policy.archive_days:
+        return 0
+    # 运行中的报告还在写入详情，没有详情的报告无需归档
+    reports = models.Report.objects.filter(project_id=project_id, archive__isnull=True, status=1,
+                                           create_time__lt=now - datetime.timedelta(days=policy.archive_days)). \
+        annotate(has_case=Exists(models.ReportCase.objects.filter(report=OuterRef('pk'))),
+                 has_detail=Exists(models.ReportDetail.objects.filter(report=OuterRef('pk')))). \
+        filter(Q(has_case=True) | Q(has_detail=True))
+    archived = 0
+    last_id = 0
+    while True:
+        batch = list(reports.filter(id__gt=last_id).order_by('id')[:REPORT_RETENTION_BATCH])
+        if not batch:
+            return archived
+        for report in batch:
+            archive_report(report)
+            archived += 1
+        last_id = batch[-1].id
+
+
+def sweep_blobs(min_age=24 * 60 * 60):
+    """
+    删除不再被引用的 blob 文件，min_age 秒内新建的文件可能正在被写入的报告引用，不删除
+    """
+    referenced = set()
+    for field in ('request_body', 'response_content'):
+        refs = models.ReportBody.objects.filter(**{field + '__startswith': blob.BLOB_MARKER}). \
+            values_list(field, flat=True)
+        referenced.update(ref[len(blob.BLOB_MARKER):] for ref in refs.iterator())
+
+    removed = 0
+    expire = time.time() - min_age
+    for digest, path in blob.iter_blobs():
+        if digest in referenced or os.path.getmtime(path) >= expire:
+            continue
+        # 收集引用后可能有报告再次写入相同内容，删除前重新检查
+        ref = blob.BLOB_MARKER + digest
+        if models.ReportBody.objects.filter(Q(request_body=ref) | Q(response_content=ref)).exists():
+            continue
+        try:
+            if os.path.getmtime(path) < expire:
+                os.remove(path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def run_retention():
+    """
+    对所有项目执行保留策略，返回处理结果
+    """
+    now = datetime.datetime.now()
+    result = {"deleted": 0, "archived": 0}
+    for project_id in models.Project.objects.values_list('id', flat=True):
+        policy = get_policy(project_id)
+        result["deleted"] += delete_reports(get_expired(project_id, policy, now))
+        result["archived"] += archive_reports(project_id, policy, now)
+    result["blobs"] = sweep_blobs()
+    return result
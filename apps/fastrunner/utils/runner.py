@@ -29,7 +29,6 @@ class DebugCode(object):
         """ dumps file.py and run
         """
         try:
-            os.chdir(self.temp)
             files = models.Pycode.objects.filter(project__id=self.project)
             for file in files:
                 file_path = os.path.join(self.temp, file.name)
@@ -41,7 +40,8 @@ class DebugCode(object):
                 myfile_path = os.path.join(BASE_DIR, 'media', str(testdata.file))
                 loader.FileLoader.copy_file(myfile_path, testdata_path)
             run_file_path = os.path.join(self.temp, self.filename)
-            self.resp = decode(subprocess.check_output([EXEC, run_file_path], stderr=subprocess.STDOUT, timeout=60))
+            self.resp = decode(subprocess.check_output([EXEC, run_file_path], stderr=subprocess.STDOUT,
+                                                       cwd=self.temp, timeout=60))
 
         except subprocess.CalledProcessError as e:
             self.resp = decode(e.output)
@@ -49,7 +49,6 @@ class DebugCode(object):
         except subprocess.TimeoutExpired:
             self.resp = 'RunnerTimeOut'
 
-        os.chdir(BASE_DIR)
         shutil.rmtree(self.temp)
 
 
@@ -0,0 +1,185 @@
+# _*_ coding: utf-8 _*_
+import re
+import threading
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from fastrunner import models
+
+"""接口、用例、配置的全文搜索
+    名称、url、请求方式与主体信息切分为词后写入 SearchToken 倒排表，用例的词包含其全部步骤
+    保存时由 signals 更新，批量写入或删除的地方显式调用 index_cases/remove
+    用例的索引在事务提交后更新，同一事务内多次保存步骤只索引一次
+"""
+KIND_API = 'api'
+KIND_CASE = 'case'
+KIND_CONFIG = 'config'
+
+MODELS = {
+    KIND_API: models.API,
+    KIND_CASE: models.Case,
+    KIND_CONFIG: models.Config,
+}
+
+TOKEN_LENGTH = 64
+BULK_BATCH_SIZE = 500
+
+# 主体信息 JSON 中每个对象都有的键，不参与索引
+STOP_TOKENS = {
+    'name', 'request', 'url', 'method', 'headers', 'json', 'data', 'params', 'files', 'validate', 'variables',
+    'extract', 'setup_hooks', 'teardown_hooks', 'desc', 'header', 'equals', 'check', 'expect', 'comparator',
+    'base_url', 'parameters', 'output', 'true', 'false', 'null', 'none', 'times', 'http', 'https',
+}
+
+_word = re.compile(r'[0-9a-z_]+|[一-鿿]+')
+_local = threading.local()  # 连接按线程区分，等待提交后索引的用例也按线程保存
+
+
+def tokenize(text):
+    """
+    英文数字按单词切分，中文按相邻两字切分
+    """
+    tokens = []
+    for word in _word.findall(str(text or '').lower()):
+        if '一' <= word[0] <= '鿿':
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[index:index + 2] for index in range(len(word) - 1))
+        elif word not in STOP_TOKENS:
+            tokens.append(word[:TOKEN_LENGTH])
+    return tokens
+
+
+def collect(counter, text, weight):
+    for token in tokenize(text):
+        counter[token] += weight
+
+
+def save_tokens(project_id, kind, object_id, counter):
+    tokens = counter.items()
+    with transaction.atomic():
+        models.SearchToken.objects.filter(kind=kind, object_id=object_id).delete()
+        models.SearchToken.objects.bulk_create([models.SearchToken(**{
+            "project_id": project_id,
+            "kind": kind,
+            "object_id": object_id,
+            "token": token,
+            "weight": weight
+        }) for token, weight in tokens], batch_size=BULK_BATCH_SIZE)
+
+
+def index_api(api):
+    counter = Counter()
+    collect(counter, api.name, 5)
+    collect(counter, api.url, 4)
+    collect(counter, api.method, 2)
+    collect(counter, api.body, 1)
+    save_tokens(api.project_id, KIND_API, api.id, counter)
+
+
+def index_config(config):
+    counter = Counter()
+    collect(counter, config.name, 5)
+    collect(counter, config.base_url, 4)
+    collect(counter, config.body, 1)
+    save_tokens(config.project_id, KIND_CONFIG, config.id, counter)
+
+
+def index_cases(case_ids):
+    """
+    用例名称与全部步骤一起索引
+    """
+    steps = {}
+    for step in models.CaseStep.objects.filter(case_id__in=case_ids). \
+            values('case_id', 'name', 'url', 'method', 'body').iterator():
+        steps.setdefault(step['case_id'], []).append(step)
+
+    for case in models.Case.objects.filter(id__in=case_ids).values('id', 'name', 'project_id'):
+        counter = Counter()
+        collect(counter, case['name'], 5)
+        for step in steps.get(case['id'], []):
+            collect(counter, step['name'], 3)
+            collect(counter, step['url'], 4)
+            collect(counter, step['method'], 2)
+            collect(counter, step['body'], 1)
+        save_tokens(case['project_id'], KIND_CASE, case['id'], counter)
+
+
+def index_case(case_id):
+    index_cases([case_id])
+
+
+def index_case_on_commit(case_id):
+    """
+    当前事务提交后索引用例，不在事务中时立即索引
+    事务回滚时回调被丢弃，等待的用例随之重新开始收集
+    """
+    pending = getattr(_local, 'cases', None)
+    connection = transaction.get_connection()
+    if pending is not None and any(func is flush_cases for _, func in connection.run_on_commit):
+        pending.add(case_id)
+        return
+    _local.cases = {case_id}
+    transaction.on_commit(flush_cases)
+
+
+def flush_cases():
+    pending = getattr(_local, 'cases', None)
+    _local.cases = None
+    if pending:
+        index_cases(sorted(pending))
+
+
+def remove(kind, ids):
+    models.SearchToken.objects.filter(kind=kind, object_id__in=ids).delete()
+
+
+def rebuild(project_id=None, batch_size=200):
+    """
+    重建索引，project_id 为空时重建全部项目
+    """
+    for kind, model in MODELS.items():
+        queryset = model.objects.all() if project_id is None else model.objects.filter(project_id=project_id)
+        ids = list(queryset.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            if kind == KIND_CASE:
+                index_cases(batch)
+                continue
+            index = index_api if kind == KIND_API else index_config
+            for instance in model.objects.filter(id__in=batch):
+                index(instance)
+
+
+def search(project_id, kind, query):
+    """
+    返回包含全部查询词的对象 [{object_id, score}]，按相关度排序
+    """
+    tokens = set(tokenize(query))
+    if not tokens:
+        return models.SearchToken.objects.none()
+    return models.SearchToken.objects.filter(project_id=project_id, kind=kind, token__in=tokens). \
+        values('object_id'). \
+        annotate(matched=Count('token', distinct=True), score=Sum('weight')). \
+        filter(matched=len(tokens)). \
+        order_by('-score', '-object_id')
+
+
+def load_results(kind, rows):
+    """
+    搜索结果补上名称等信息，已删除的对象跳过
+    """
+    model = MODELS[kind]
+    fields = ['id', 'name', 'relation', 'url', 'method'] if kind == KIND_API else \
+        ['id', 'name', 'relation'] if kind == KIND_CASE else ['id', 'name', 'base_url']
+    objects = {content['id']: content for content in
+               model.objects.filter(id__in=[row['object_id'] for row in rows]).values(*fields)}
+    results = []
+    for row in rows:
+        content = objects.get(row['object_id'])
+        if content is not None:
+            results.append(dict(content, score=row['score']))
+    return results
@@ -1,26 +1,260 @@
-def get_tree_max_id(value, list_id=[]):
+from django.db import transaction
+from django.db.models import F, Max
+
+from fastrunner import models
+from fastrunner.utils.cache import get_shared_cache
+from fastrunner.utils.parser import loads_body, dumps_body
+from FasterRunner.settings import TREE_CACHE_BACKEND, TREE_CACHE_TIMEOUT
+
+"""树形结构节点
+    节点保存在 RelationNode 中，Relation.max_id 记录已分配的最大节点 id，删除后的 id 不再复用
+    Relation.max_id 为空时节点尚未从旧的 Relation.tree 文本导入，首次访问时导入
+    节点的每次修改在 Relation 行锁内进行并递增 Relation.version，整棵树保存时版本过期则拒绝
+    前端使用的完整树由节点表一次查询生成，配置共享缓存时按 version 缓存 TREE_CACHE_TIMEOUT 秒
+"""
+DEFAULT_TREE = [{'id': 1, 'label': 'testdata', 'children': []}]
+
+
+class TreeConflict(Exception):
+    """
+    整棵树保存时所基于的版本已被其他修改覆盖
+    """
+
+
+def get_tree_max_id(value):
     """
     得到最大Tree max id
     """
-    if not value:
-        return 0  # the first node id
+    max_id = 0  # the first node id
+    stack = list(value or [])
+    while stack:
+        content = stack.pop()
+        max_id = max(max_id, content['id'])
+        stack.extend(content.get('children') or [])
+    return max_id
+
+
+def iter_nodes(value, parent_id=0):
+    """
+    展开树形结构，返回 (node_id, parent_id, label, position)
+    """
+    stack = [(parent_id, value or [])]
+    while stack:
+        parent_id, children = stack.pop()
+        for position, content in enumerate(children):
+            yield content['id'], parent_id, content['label'], position
+            stack.append((content['id'], content.get('children') or []))
+
+
+def get_nodes(relation):
+    return models.RelationNode.objects.filter(project_id=relation.project_id, type=relation.type)
+
+
+def get_tree_key(relation):
+    return 'relation_tree:%s:%s' % (relation.id, relation.version)
+
+
+def lock_relation(relation):
+    """
+    同一棵树的节点修改串行执行，返回加锁后读取的最新 Relation
+    """
+    return models.Relation.objects.select_for_update().get(id=relation.id)
+
+
+def bump_version(relation, *fields):
+    relation.version += 1
+    relation.save(update_fields=['version'] + list(fields))
+
+
+def get_relation(project_id, tree_type):
+    """
+    返回项目的树，不存在时创建，节点未导入时先导入
+    """
+    relation, created = models.Relation.objects.get_or_create(project_id=project_id, type=tree_type,
+                                                              defaults={'tree': dumps_body(DEFAULT_TREE)})
+    return import_tree(relation)
+
+
+def import_tree(relation):
+    """
+    Relation.tree 文本导入节点表，已导入时直接返回，旧数据中重复的节点 id 只保留第一个
+    """
+    if relation.max_id is not None:
+        return relation
+    with transaction.atomic():
+        relation = lock_relation(relation)
+        if relation.max_id is None:
+            rows = []
+            seen = set()
+            for row in iter_nodes(loads_body(relation.tree) or []):
+                if row[0] not in seen:
+                    seen.add(row[0])
+                    rows.append(row)
+            replace_nodes(relation, rows)
+    return relation
 
-    if isinstance(value, list):
-        for content in value:  # content -> dict
-            try:
-                children = content['children']
-            except KeyError:
-                """
-                待返回错误信息
-                """
-                pass
 
-            if children:
-                get_tree_max_id(children)
+def replace_nodes(relation, rows):
+    """
+    替换节点表，调用方需已持有 relation 的行锁
+    """
+    get_nodes(relation).delete()
+    models.RelationNode.objects.bulk_create([models.RelationNode(**{
+        "project_id": relation.project_id,
+        "type": relation.type,
+        "node_id": node_id,
+        "parent_id": parent_id,
+        "label": label,
+        "position": position
+    }) for node_id, parent_id, label, position in rows], batch_size=500)
+    relation.max_id = max([relation.max_id or 0] + [row[0] for row in rows])
+    bump_version(relation, 'max_id')
 
-            list_id.append(content['id'])
 
-    return max(list_id)
+def save_nodes(relation, body, version=None, max_id=None):
+    """整棵树替换节点表，返回保存后的 Relation
+        version: 前端读取树时的 Relation.version，与当前版本不同时抛出 TreeConflict
+        max_id: 未传 version 的旧前端使用，小于当前 max_id 时说明期间有新增节点，抛出 TreeConflict
+        节点 id 重复时抛出 ValueError
+    """
+    rows = list(iter_nodes(body))
+    node_ids = [row[0] for row in rows]
+    if len(set(node_ids)) != len(node_ids):
+        raise ValueError('节点id重复')
+
+    with transaction.atomic():
+        relation = lock_relation(relation)
+        if version is not None:
+            if int(version) != relation.version:
+                raise TreeConflict
+        elif max_id is not None and int(max_id) < (relation.max_id or 0):
+            raise TreeConflict
+        replace_nodes(relation, rows)
+    return relation
+
+
+def build_tree(relation):
+    """
+    节点表生成完整树 [{id, label, children}]
+    """
+    nodes = {}
+    tree = []
+    rows = list(get_nodes(relation).order_by('parent_id', 'position', 'node_id').
+                values_list('node_id', 'parent_id', 'label'))
+    for node_id, parent_id, label in rows:
+        nodes[node_id] = {'id': node_id, 'label': label, 'children': []}
+    for node_id, parent_id, label in rows:
+        parent = nodes.get(parent_id)
+        (parent['children'] if parent else tree).append(nodes[node_id])
+    return tree
+
+
+def get_tree(relation):
+    """
+    relation 需是刚读取的 Relation，缓存按其 version 区分，未配置共享缓存时每次从节点表生成
+    """
+    cache = get_shared_cache(TREE_CACHE_BACKEND)
+    if cache is None:
+        return build_tree(relation)
+    key = get_tree_key(relation)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_tree(relation)
+        cache.set(key, tree, TREE_CACHE_TIMEOUT)
+    return tree
+
+
+def get_descendants(relation, node_id):
+    """
+    节点及其全部子孙节点的 id
+    """
+    children = {}
+    for child_id, parent_id in get_nodes(relation).values_list('node_id', 'parent_id'):
+        children.setdefault(parent_id, []).append(child_id)
+
+    node_ids = [node_id]
+    seen = {node_id}
+    for current in node_ids:
+        for child_id in children.get(current, []):
+            if child_id not in seen:
+                seen.add(child_id)
+                node_ids.append(child_id)
+    return node_ids
+
+
+def add_node(relation, parent_id, label):
+    """
+    新增节点，parent_id 为 0 时添加到根，排在兄弟节点最后
+    """
+    with transaction.atomic():
+        relation = lock_relation(relation)
+        if parent_id and not get_nodes(relation).filter(node_id=parent_id).exists():
+            raise models.RelationNode.DoesNotExist
+        position = get_nodes(relation).filter(parent_id=parent_id).aggregate(Max('position'))['position__max']
+        relation.max_id += 1
+        bump_version(relation, 'max_id')
+        node = models.RelationNode.objects.create(**{
+            "project_id": relation.project_id,
+            "type": relation.type,
+            "node_id": relation.max_id,
+            "parent_id": parent_id,
+            "label": label,
+            "position": 0 if position is None else position + 1
+        })
+    return node
+
+
+def rename_node(relation, node_id, label):
+    with transaction.atomic():
+        relation = lock_relation(relation)
+        node = get_nodes(relation).get(node_id=node_id)
+        node.label = label
+        node.save(update_fields=['label'])
+        bump_version(relation)
+    return node
+
+
+def move_node(relation, node_id, parent_id, position=None):
+    """
+    移动节点到 parent_id 下的 position 位置，position 为空时排在最后
+    不能移动到自身或子孙节点下，此时抛出 ValueError
+    """
+    with transaction.atomic():
+        relation = lock_relation(relation)
+        node = get_nodes(relation).get(node_id=node_id)
+        if parent_id:
+            if parent_id in get_descendants(relation, node_id):
+                raise ValueError('不能移动到自身或子孙节点下')
+            if not get_nodes(relation).filter(node_id=parent_id).exists():
+                raise models.RelationNode.DoesNotExist
+
+        get_nodes(relation).filter(parent_id=node.parent_id, position__gt=node.position). \
+            update(position=F('position') - 1)
+        siblings = get_nodes(relation).filter(parent_id=parent_id).exclude(node_id=node_id)
+        count = siblings.count()
+        position = count if position is None else min(max(int(position), 0), count)
+        siblings.filter(position__gte=position).update(position=F('position') + 1)
+
+        node.parent_id = parent_id
+        node.position = position
+        node.save()
+        bump_version(relation)
+    return node
+
+
+def remove_node(relation, node_id):
+    """
+    删除节点及子孙节点，返回删除的节点 id
+    """
+    with transaction.atomic():
+        relation = lock_relation(relation)
+        node = get_nodes(relation).get(node_id=node_id)
+        node_ids = get_descendants(relation, node_id)
+        get_nodes(relation).filter(node_id__in=node_ids).delete()
+        get_nodes(relation).filter(parent_id=node.parent_id, position__gt=node.position). \
+            update(position=F('position') - 1)
+        bump_version(relation)
+    return node_ids
 
 
 def get_file_size(size):
@@ -0,0 +1,185 @@
+# _*_ coding: utf-8 _*_
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from fastrunner import models
+from FasterRunner.settings import BASE_DIR, MEDIA_ROOT, DEBUGTALK_WORKSPACE_MAX, DEBUGTALK_WORKSPACE_MAX_AGE
+
+"""项目驱动代码工作目录缓存
+    tempWorkDir/workspace/<project>/<digest>/ 下存放项目的 Pycode 与测试数据文件，
+    digest 由文件的 id/name/update_time 计算，内容不变时直接复用，变化时重建
+    多个进程共用同一目录，每次使用时更新目录的修改时间，旧目录超过 DEBUGTALK_WORKSPACE_MAX_AGE 未使用才删除
+"""
+WORKSPACE_ROOT = os.path.join(BASE_DIR, 'tempWorkDir', 'workspace')
+
+_lock = threading.RLock()
+_workspaces = OrderedDict()  # project -> workspace path, 按最近使用排序
+_modules = {}  # workspace path -> 已加载的 debugtalk
+_cwd = threading.Condition()
+_cwd_state = {"key": None, "count": 0, "previous": None}  # 当前占用进程工作目录的运行
+
+
+def get_module_name(path):
+    """
+    工作目录对应的唯一模块名
+    """
+    return 'debugtalk_' + hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+def get_module(path):
+    """
+    返回工作目录已加载的 debugtalk，未加载时返回 None
+    """
+    return _modules.get(path)
+
+
+def set_module(path, debugtalk):
+    with _lock:
+        if os.path.isdir(path):
+            _modules[path] = debugtalk
+
+
+def get_digest(project):
+    """
+    根据驱动代码和测试数据的更新时间计算工作目录摘要
+    """
+    md5 = hashlib.md5()
+    py_files = models.Pycode.objects.filter(project__id=project).order_by('id'). \
+        values_list('id', 'name', 'update_time')
+    testdata_files = models.ModelWithFileField.objects.filter(project__id=project).order_by('id'). \
+        values_list('id', 'name', 'file', 'update_time')
+    for content in py_files:
+        md5.update(('py:%s:%s:%s;' % content).encode('utf-8'))
+    for content in testdata_files:
+        md5.update(('data:%s:%s:%s:%s;' % content).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def build_workspace(project, path):
+    """
+    生成工作目录，先写入临时目录再整体重命名，避免其他进程读到写了一半的目录
+    """
+    project_path = os.path.dirname(path)
+    os.makedirs(project_path, exist_ok=True)
+    temp_path = tempfile.mkdtemp(prefix='building', dir=project_path)
+    try:
+        for file in models.Pycode.objects.filter(project__id=project):
+            with io.open(os.path.join(temp_path, file.name), 'w', encoding='utf-8') as stream:
+                stream.write(file.code)
+        for testdata in models.ModelWithFileField.objects.filter(project__id=project):
+            shutil.copyfile(os.path.join(MEDIA_ROOT, str(testdata.file)), os.path.join(temp_path, testdata.name))
+        os.rename(temp_path, path)
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    except Exception:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+
+def unload(path):
+    """
+    释放本进程加载的工作目录模块，目录保留
+    """
+    _modules.pop(path, None)
+    sys.modules.pop(get_module_name(path), None)
+
+
+def remove_stale(project, keep=None):
+    """
+    删除项目下超过 DEBUGTALK_WORKSPACE_MAX_AGE 秒未使用的工作目录
+    目录可能正被其他进程使用，只按修改时间判断
+    """
+    project_path = os.path.join(WORKSPACE_ROOT, str(project))
+    if not os.path.isdir(project_path):
+        return
+    expired = time.time() - DEBUGTALK_WORKSPACE_MAX_AGE
+    for name in os.listdir(project_path):
+        path = os.path.join(project_path, name)
+        if path == keep:
+            continue
+        try:
+            if os.path.getmtime(path) >= expired:
+                continue
+        except OSError:
+            continue
+        unload(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_workspace(project):
+    """
+    返回项目工作目录的绝对路径，驱动代码或测试数据有更新时才重建
+    """
+    project = int(project)
+    path = os.path.join(WORKSPACE_ROOT, str(project), get_digest(project))
+
+    with _lock:
+        if os.path.isdir(path):
+            os.utime(path)
+        else:
+            build_workspace(project, path)
+            remove_stale(project, keep=path)
+
+        previous = _workspaces.get(project)
+        if previous is not None and previous != path:
+            unload(previous)
+        _workspaces[project] = path
+        _workspaces.move_to_end(project)
+
+        while len(_workspaces) > DEBUGTALK_WORKSPACE_MAX:
+            _, evicted = _workspaces.popitem(last=False)
+            unload(evicted)
+
+    return path
+
+
+@contextlib.contextmanager
+def enter(path, environ=None):
+    """
+    切换到工作目录并设置环境变量后运行，驱动代码中 xlrd、pandas 等任意库的相对路径都按工作目录解析
+    当前目录与环境变量是进程级的，工作目录与环境变量都相同的运行可以同时进行，其他的等待前面的运行结束
+    """
+    environ = environ or {}
+    key = (path, tuple(sorted(environ.items())))
+    with _cwd:
+        while _cwd_state["count"] and _cwd_state["key"] != key:
+            _cwd.wait()
+        if not _cwd_state["count"]:
+            _cwd_state["previous"] = os.getcwd()
+            os.chdir(path)
+            os.environ.update(environ)
+            _cwd_state["key"] = key
+        _cwd_state["count"] += 1
+    try:
+        yield path
+    finally:
+        with _cwd:
+            _cwd_state["count"] -= 1
+            if not _cwd_state["count"]:
+                for name in environ:
+                    os.environ.pop(name, None)
+                os.chdir(_cwd_state["previous"])
+                _cwd_state["key"] = None
+                _cwd.notify_all()
+
+
+def invalidate(project):
+    """
+    驱动代码或测试数据变更后释放已加载的模块，下次运行按新的摘要重建目录，旧目录按修改时间清理
+    """
+    project = int(project)
+    with _lock:
+        path = _workspaces.pop(project, None)
+        if path is not None:
+            unload(path)
+        remove_stale(project)
@@ -3,6 +3,7 @@ import xlsxwriter
 import time
 
 from FasterRunner.settings import MEDIA_ROOT
+from fastrunner.utils.report import resolve_content
 
 
 class WriteExcel(object):
@@ -114,9 +115,9 @@ def get_error_response_content(summary_details):
                         error_response = record["meta_data"]["response"]
                         error_api_name = record["name"]
                         error_traceback = record["attachment"]
-                        error_request_body = error_request["body"] \
+                        error_request_body = resolve_content(error_request["body"]) \
                             if 'body' in error_request.keys() and error_request["body"] is not None else ''
-                        error_response_content = error_response["content"] \
+                        error_response_content = resolve_content(error_response["content"]) \
                             if 'content' in error_response.keys() and error_response["content"] is not None else ''
                         testcase_result["error_api_content"].append([error_api_name, error_traceback, error_request_body, error_response_content])
             else:
@@ -125,9 +126,9 @@ def get_error_response_content(summary_details):
                 error_response = error_api["meta_data"]["response"]
                 error_api_name = error_api["name"]
                 error_traceback = error_api["attachment"]
-                error_request_body = error_request["body"] \
+                error_request_body = resolve_content(error_request["body"]) \
                     if 'body' in error_request.keys() and error_request["body"] is not None else ''
-                error_response_content = error_response["content"] \
+                error_response_content = resolve_content(error_response["content"]) \
                     if 'content' in error_response.keys() and error_response["content"] is not None else ''
                 testcase_result["error_api_content"].append([error_api_name, error_traceback, error_request_body, error_response_content])
             testcase_result["testcase_status"] = 'fail'
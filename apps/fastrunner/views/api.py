@@ -1,3 +1,5 @@
+import datetime
+
 from django.db import DataError
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.decorators import method_decorator
@@ -5,12 +7,15 @@ from rest_framework.viewsets import GenericViewSet
 from rest_framework.response import Response
 from rest_framework.permissions import DjangoModelPermissions
 
+from FasterRunner import pagination
 from fastrunner import models, serializers
 from fastrunner.utils import response
+from fastrunner.utils import search as search_index
+from fastrunner.utils.cache import load_body
 from fastrunner.utils.decorator import request_log
-from fastrunner.utils.parser import Format, Parse
-from fastrunner.utils.permissions import IsBelongToProject
-from fastrunner.utils.prepare import api_end
+from fastrunner.utils.parser import Format, Parse, dumps_body
+from fastrunner.utils.permissions import IsBelongToProject, filter_project
+from fastrunner.utils.prepare import api_end, apis_end, filter_ids
 
 
 class APITemplateView(GenericViewSet):
@@ -19,6 +24,7 @@ class APITemplateView(GenericViewSet):
     """
     serializer_class = serializers.APISerializer
     queryset = models.API.objects
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     @method_decorator(request_log(level='DEBUG'))
@@ -57,7 +63,7 @@ class APITemplateView(GenericViewSet):
 
         api_body = {
             'name': api.name,
-            'body': api.testcase,
+            'body': dumps_body(api.testcase),
             'url': api.url,
             'method': api.method,
             'project': models.Project.objects.get(id=api.project),
@@ -82,9 +88,10 @@ class APITemplateView(GenericViewSet):
 
         api_body = {
             'name': api.name,
-            'body': api.testcase,
+            'body': dumps_body(api.testcase),
             'url': api.url,
             'method': api.method,
+            'update_time': datetime.datetime.now()
         }
 
         try:
@@ -92,6 +99,10 @@ class APITemplateView(GenericViewSet):
         except ObjectDoesNotExist:
             return Response(response.API_NOT_FOUND)
 
+        # update 不触发 post_save
+        for instance in models.API.objects.filter(id=pk):
+            search_index.index_api(instance)
+
         return Response(response.API_UPDATE_SUCCESS)
 
     @method_decorator(request_log(level='INFO'))
@@ -105,9 +116,9 @@ class APITemplateView(GenericViewSet):
         pk = kwargs['pk']
         name = request.data['name']
         api = models.API.objects.get(id=pk)
-        body = eval(api.body)
+        body = load_body(api)
         body["name"] = name
-        api.body = body
+        api.body = dumps_body(body)
         api.id = None
         api.name = name
         api.save()
@@ -124,11 +135,15 @@ class APITemplateView(GenericViewSet):
         """
 
         try:
+            queryset = filter_project(request, self.get_queryset())
             if kwargs.get('pk'):  # 单个删除
+                queryset.get(id=kwargs['pk'])
                 api_end(kwargs['pk'])
             else:
-                for content in request.data:
-                    api_end(content['id'])
+                ids, missing = filter_ids(queryset, request.data)
+                if missing:
+                    return Response(response.API_NOT_FOUND)
+                apis_end(ids)
 
         except ObjectDoesNotExist:
             return Response(response.API_NOT_FOUND)
@@ -145,7 +160,7 @@ class APITemplateView(GenericViewSet):
         except ObjectDoesNotExist:
             return Response(response.API_NOT_FOUND)
 
-        parse = Parse(eval(api.body))
+        parse = Parse(load_body(api))
         parse.parse_http()
 
         resp = {
@@ -1,5 +1,6 @@
 import json
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.utils.decorators import method_decorator
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import viewsets
@@ -11,14 +12,18 @@ from rest_framework.response import Response
 from fastrunner import models, serializers
 from FasterRunner import pagination
 from fastrunner.utils import response
+from fastrunner.utils import search as search_index
+from fastrunner.utils.cache import load_body
 from fastrunner.utils.decorator import request_log
-from fastrunner.utils.parser import Format
-from fastrunner.utils.permissions import IsBelongToProject
+from fastrunner.utils.prepare import filter_ids
+from fastrunner.utils.parser import Format, dumps_body
+from fastrunner.utils.permissions import IsBelongToProject, filter_project
 
 
 class ConfigView(GenericViewSet):
     serializer_class = serializers.ConfigSerializer
     queryset = models.Config.objects
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     @method_decorator(request_log(level='DEBUG'))
@@ -74,7 +79,7 @@ class ConfigView(GenericViewSet):
         config_body = {
             "name": config.name,
             "base_url": config.base_url,
-            "body": config.testcase,
+            "body": dumps_body(config.testcase),
             "project": config.project
         }
 
@@ -113,11 +118,11 @@ class ConfigView(GenericViewSet):
 
         for case in case_step:
             case.name = format.name
-            case.body = format.testcase
+            case.body = dumps_body(format.testcase)
             case.save()
 
         config.name = format.name
-        config.body = format.testcase
+        config.body = dumps_body(format.testcase)
         config.base_url = format.base_url
         config.save()
 
@@ -142,12 +147,12 @@ class ConfigView(GenericViewSet):
 
         config.id = None
 
-        body = eval(config.body)
+        body = load_body(config)
         name = request.data['name']
 
         body['name'] = name
         config.name = name
-        config.body = body
+        config.body = dumps_body(body)
         config.save()
 
         return Response(response.CONFIG_ADD_SUCCESS)
@@ -163,11 +168,17 @@ class ConfigView(GenericViewSet):
         """
 
         try:
+            queryset = filter_project(request, self.get_queryset())
             if kwargs.get('pk'):  # 单个删除
-                models.Config.objects.get(id=kwargs['pk']).delete()
+                queryset.get(id=kwargs['pk']).delete()
+                search_index.remove(search_index.KIND_CONFIG, [kwargs['pk']])
             else:
-                for content in request.data:
-                    models.Config.objects.get(id=content['id']).delete()
+                ids, missing = filter_ids(queryset, request.data)
+                if missing:
+                    return Response(response.CONFIG_NOT_EXISTS)
+                with transaction.atomic():
+                    models.Config.objects.filter(id__in=ids).delete()
+                search_index.remove(search_index.KIND_CONFIG, ids)
 
         except ObjectDoesNotExist:
             return Response(response.CONFIG_NOT_EXISTS)
@@ -178,6 +189,7 @@ class ConfigView(GenericViewSet):
 class VariablesView(GenericViewSet):
     serializer_class = serializers.VariablesSerializer
     queryset = models.Variables.objects
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     @method_decorator(request_log(level='DEBUG'))
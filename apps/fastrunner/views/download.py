@@ -1,5 +1,4 @@
 import os
-import json
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.decorators import method_decorator
@@ -12,6 +11,7 @@ from rest_framework.permissions import DjangoModelPermissions
 from fastrunner.utils import response
 from fastrunner.utils.decorator import request_log
 from fastrunner.utils.writeExcel import write_excel_log
+from fastrunner.utils.report import load_report_summary
 from fastrunner.utils.permissions import IsBelongToProject
 from fastrunner import models
 from FasterRunner.settings import MEDIA_ROOT
@@ -42,9 +42,9 @@ class DownloadView(APIView):
                 filename = fileObject.name
                 filepath = os.path.join(MEDIA_ROOT, str(fileObject.file))
             else:
-                fileObject = models.ReportDetail.objects.get(project_id=project, report_id=idno)
+                fileObject = models.Report.objects.get(project_id=project, id=idno)
                 filename = fileObject.name
-                summary = json.loads(fileObject.summary)
+                summary = load_report_summary(fileObject, blobs=False)
                 filepath = write_excel_log(summary)
 
             fileresponse = FileResponse(open(filepath, 'rb'))
@@ -1,8 +1,10 @@
+import logging
 import os
 import xlrd
 from xlrd.biffh import XLRDError
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.utils.decorators import method_decorator
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework import mixins
@@ -11,19 +13,20 @@ from rest_framework import exceptions
 from rest_framework.response import Response
 from rest_framework.permissions import DjangoModelPermissions
 from djcelery import models as celery_models
-from django.contrib.auth import get_user_model
 
-from fastrunner import models, serializers
+from fastrunner import models, serializers, tasks
 from FasterRunner import pagination
 from fastrunner.utils import response
 from fastrunner.utils import prepare
+from fastrunner.utils import workspace
 from fastrunner.utils.decorator import request_log
+from fastrunner.utils.parser import dumps_body
 from fastrunner.utils.runner import DebugCode
-from fastrunner.utils.tree import get_tree_max_id
-from fastrunner.utils.permissions import IsBelongToProject, _check_is_locked
+from fastrunner.utils import tree
+from fastrunner.utils.permissions import IsBelongToProject, get_project_ids, check_project_member, _check_is_locked
 from FasterRunner.settings import MEDIA_ROOT
 
-UserModel = get_user_model()
+logger = logging.getLogger('FasterRunner')
 
 
 class ProjectView(ModelViewSet):
@@ -37,8 +40,7 @@ class ProjectView(ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_superuser:
             return models.Project.objects.all().order_by('-create_time')
-        project_id_list = UserModel.objects.filter(id=self.request.user.id).values_list('belong_project', flat=True)
-        return models.Project.objects.filter(id__in=[_ for _ in project_id_list]).order_by('-update_time')
+        return models.Project.objects.filter(id__in=get_project_ids(self.request)).order_by('-update_time')
 
     @method_decorator(request_log(level='INFO'))
     def single(self, request, **kwargs):
@@ -67,6 +69,7 @@ class ProjectView(ModelViewSet):
 # _*_ coding:utf-8 _*_
 import xlrd
 import os
+import sys
 
 class Xlaccountinfo():
     # 获取excel数据，从第三行开始，第二行是表头，第一行是备注
@@ -127,8 +130,8 @@ def xlsxPlatform(excelName, sheetName):
     return info
     
 if __name__ == '__main__':
-    excelName = os.environ["excelName"]
-    sheetName = os.environ["excelsheet"]
+    excelName = sys.argv[1]
+    sheetName = sys.argv[2]
                                      """)
         # 自动生成API tree
         models.Relation.objects.create(project=instance)
@@ -164,6 +167,13 @@ class TreeView(GenericViewSet):
         queryset = models.Relation.objects.filter(project__id=project_id).order_by('-update_time')
         return queryset
 
+    def check_project(self, request, project_id):
+        """
+        各操作不经过 get_object，IsBelongToProject 不会被调用，这里检查用户是否属于该项目
+        """
+        if not request.user.is_superuser and int(project_id) not in get_project_ids(request):
+            raise exceptions.PermissionDenied()
+
     @method_decorator(request_log(level='INFO'))
     def get(self, request, **kwargs):
         """
@@ -175,33 +185,43 @@ class TreeView(GenericViewSet):
             tree_type = request.query_params['type']
         except KeyError:
             return Response(response.KEY_MISS)
-        try:
-            tree = models.Relation.objects.get(project_id=kwargs['pk'], type=tree_type)
-            body = eval(tree.tree)
-        except ObjectDoesNotExist as e:
-            tree = models.Relation.objects.create(project_id=kwargs['pk'], type=tree_type, tree=[{'id': 1, 'label': 'testdata', 'children': []}])
-            body = []
-
-        tree = {
-            "tree": body,
-            "id": tree.id,
+        self.check_project(request, kwargs['pk'])
+        relation = tree.get_relation(kwargs['pk'], tree_type)
+
+        body = {
+            "tree": tree.get_tree(relation),
+            "id": relation.id,
             "success": True,
-            "max": get_tree_max_id(body)
+            "max": relation.max_id,
+            "version": relation.version
         }
-        return Response(tree)
+        return Response(body)
 
     @method_decorator(request_log(level='INFO'))
     def patch(self, request, **kwargs):
         """
         修改树形结构，ID不能重复
+        带上读取树时返回的 version（或 max）时，树已被其他人修改则拒绝
+        都不带的旧请求直接覆盖，记录警告日志
         """
         try:
             body = request.data['body']
             mode = request.data['mode']
+            version = request.data.get('version')
+            max_id = request.data.get('max')
 
             relation = models.Relation.objects.get(id=kwargs['pk'])
-            relation.tree = body
-            relation.save()
+            self.check_project(request, relation.project_id)
+            if version is None and max_id is None:
+                logger.warning("树 {id} 的修改请求没有 version，直接覆盖".format(id=relation.id))
+            relation = tree.import_tree(relation)
+            # 替换节点与删除节点下的数据在同一事务内
+            with transaction.atomic():
+                relation = tree.lock_relation(relation)
+                #  mode -> True remove node，子孙节点在替换前计算
+                node_ids = tree.get_descendants(relation, int(request.data['node'])) if mode else None
+                relation = tree.save_nodes(relation, body, version, max_id)
+                deleted = prepare.tree_end(request.data, relation.project, node_ids) if mode else {}
 
         except KeyError:
             return Response(response.KEY_MISS)
@@ -209,14 +229,86 @@ class TreeView(GenericViewSet):
         except ObjectDoesNotExist:
             return Response(response.SYSTEM_ERROR)
 
-        #  mode -> True remove node
-        if mode:
-            prepare.tree_end(request.data, relation.project)
+        except tree.TreeConflict:
+            return Response(response.TREE_VERSION_CONFLICT)
+
+        except ValueError:
+            return Response(response.TREE_NODE_DUPLICATE)
+
+        return Response(dict(response.TREE_UPDATE_SUCCESS, tree=body, max=relation.max_id,
+                             version=relation.version, deleted=deleted))
+
+    @method_decorator(request_log(level='INFO'))
+    def add_node(self, request, **kwargs):
+        """
+        新增节点 {type: int, parent: int, label: str}，parent 为 0 时添加到根
+        """
+        self.check_project(request, kwargs['pk'])
+        try:
+            relation = tree.get_relation(kwargs['pk'], request.data['type'])
+            node = tree.add_node(relation, int(request.data.get('parent', 0)), request.data['label'])
+        except KeyError:
+            return Response(response.KEY_MISS)
+        except ObjectDoesNotExist:
+            return Response(response.TREE_NODE_NOT_EXISTS)
+
+        return Response(dict(response.TREE_ADD_SUCCESS, node=format_node(node), max=node.node_id))
+
+    @method_decorator(request_log(level='INFO'))
+    def update_node(self, request, **kwargs):
+        """
+        重命名或移动节点 {type: int, label: str, parent: int, position: int}
+        传 parent 时移动，position 为空时排在最后
+        """
+        self.check_project(request, kwargs['pk'])
+        try:
+            relation = tree.get_relation(kwargs['pk'], request.data['type'])
+            node = None
+            if 'label' in request.data:
+                node = tree.rename_node(relation, kwargs['node_id'], request.data['label'])
+            if 'parent' in request.data:
+                node = tree.move_node(relation, kwargs['node_id'], int(request.data['parent']),
+                                      request.data.get('position'))
+        except KeyError:
+            return Response(response.KEY_MISS)
+        except ObjectDoesNotExist:
+            return Response(response.TREE_NODE_NOT_EXISTS)
+        except ValueError:
+            return Response(response.TREE_NODE_MOVE_ERROR)
+
+        if node is None:
+            return Response(response.KEY_MISS)
+        return Response(dict(response.TREE_UPDATE_SUCCESS, node=format_node(node)))
+
+    @method_decorator(request_log(level='INFO'))
+    def delete_node(self, request, **kwargs):
+        """
+        删除节点及子孙节点，同时删除节点下的接口或用例，查询参数 type: int
+        """
+        self.check_project(request, kwargs['pk'])
+        try:
+            tree_type = int(request.query_params['type'])
+            relation = tree.get_relation(kwargs['pk'], tree_type)
+            # 删除节点与删除节点下的数据在同一事务内
+            with transaction.atomic():
+                node_ids = tree.remove_node(relation, kwargs['node_id'])
+                deleted = prepare.tree_end({"node": kwargs['node_id'], "type": tree_type}, relation.project,
+                                           node_ids)
+        except KeyError:
+            return Response(response.KEY_MISS)
+        except ObjectDoesNotExist:
+            return Response(response.TREE_NODE_NOT_EXISTS)
+
+        return Response(dict(response.TREE_DELETE_SUCCESS, nodes=node_ids, deleted=deleted))
 
-        response.TREE_UPDATE_SUCCESS['tree'] = body
-        response.TREE_UPDATE_SUCCESS['max'] = get_tree_max_id(body)
 
-        return Response(response.TREE_UPDATE_SUCCESS)
+def format_node(node):
+    return {
+        "id": node.node_id,
+        "label": node.label,
+        "parent": node.parent_id,
+        "position": node.position
+    }
 
 
 class FileView(GenericViewSet, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.DestroyModelMixin):
@@ -226,7 +318,7 @@ class FileView(GenericViewSet, mixins.CreateModelMixin, mixins.ListModelMixin, m
     destroy:删除文件
     """
     serializer_class = serializers.FileSerializer
-    pagination_class = pagination.MyPageNumberPagination
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     def get_queryset(self):
@@ -280,26 +372,36 @@ class FileView(GenericViewSet, mixins.CreateModelMixin, mixins.ListModelMixin, m
         if kwargs.get('pk') and int(kwargs['pk']) != -1:
             _check_is_locked(request.query_params['project'], 1, kwargs['pk'])
             instance = self.get_object()
-            filepath = os.path.join(MEDIA_ROOT, str(instance.file))
-            if os.path.exists(filepath):
-                os.remove(filepath)
             self.perform_destroy(instance)
         elif request.data:
-            for content in request.data:
-                self.kwargs['pk'] = content['id']
-                try:
-                    _check_is_locked(content['project'], 1, content['id'])
-                except exceptions.NotAcceptable as e:
-                    continue
-                instance = self.get_object()
-                filepath = os.path.join(MEDIA_ROOT, str(instance.file))
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                self.perform_destroy(instance)
+            project_id = request.query_params['project']
+            # 权限只与项目有关，整批检查一次
+            check_project_member(request, project_id)
+            ids, missing = prepare.filter_ids(self.get_queryset(), request.data)
+            if missing:
+                raise exceptions.NotFound()
+            # 锁定的文件跳过
+            locked = models.LockFiles.objects.filter(project_id=project_id, lock_type=1, file_id__in=ids). \
+                values_list('file_id', flat=True)
+            queryset = self.get_queryset().filter(id__in=ids).exclude(id__in=list(locked))
+            self.perform_bulk_destroy(queryset, project_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def perform_destroy(self, instance):
+        self.perform_bulk_destroy(models.ModelWithFileField.objects.filter(id=instance.id), instance.project_id)
+
+    def perform_bulk_destroy(self, queryset, project_id):
+        """
+        一个事务内删除，文件在提交后由 celery 任务删除
+        """
+        with transaction.atomic():
+            names = [name for name in queryset.values_list('file', flat=True) if name]
+            queryset.delete()
+            transaction.on_commit(lambda: tasks.remove_files.delay(names))
+        workspace.invalidate(project_id)
+
     def perform_create(self, serializer):
-        serializer.save()
+        instance = serializer.save()
         try:
             excel_file = models.ModelWithFileField.objects.get(id=serializer.data["id"])
             file_path = os.path.join(MEDIA_ROOT, str(excel_file.file))
@@ -307,10 +409,11 @@ class FileView(GenericViewSet, mixins.CreateModelMixin, mixins.ListModelMixin, m
             excel_tree = {"value": excel_file.name, "label": excel_file.name, "children": []}
             for sheet in excel_info.sheets():
                 excel_tree["children"].append({"value": sheet.name, "label": sheet.name})
-            excel_file.excel_tree = excel_tree
+            excel_file.excel_tree = dumps_body(excel_tree)
             excel_file.save()
         except XLRDError as e:
             pass
+        workspace.invalidate(instance.project_id)
 
 
 class PycodeRunView(GenericViewSet, mixins.RetrieveModelMixin):
@@ -344,7 +447,7 @@ class PycodeView(ModelViewSet):
     驱动代码模块
     """
     serializer_class = serializers.PycodeSerializer
-    pagination_class = pagination.MyPageNumberPagination
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     def get_queryset(self):
@@ -369,3 +472,16 @@ class PycodeView(ModelViewSet):
                 if instance.name != 'debugtalk.py':
                     self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def perform_create(self, serializer):
+        instance = serializer.save()
+        workspace.invalidate(instance.project_id)
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        workspace.invalidate(instance.project_id)
+
+    def perform_destroy(self, instance):
+        project_id = instance.project_id
+        instance.delete()
+        workspace.invalidate(project_id)
@@ -1,14 +1,23 @@
 import json
 
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.shortcuts import render_to_response
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, mixins
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework import status
+from rest_framework import exceptions
 
 from FasterRunner import pagination
+from FasterRunner.settings import REPORT_STEP_PAGE_SIZE, REPORT_STEP_MAX_PAGE_SIZE
 from fastrunner import models, serializers
-from fastrunner.utils.permissions import IsBelongToProject
+from fastrunner.utils.permissions import IsBelongToProject, IsReportReadable, get_report_sign, check_project_member
+from fastrunner.utils import response
+from fastrunner.utils.prepare import filter_ids
+from fastrunner.utils.report import load_report_summary, load_case_page, load_step_body, format_content, \
+    format_summary, delete_details
 
 
 class ReportView(GenericViewSet, mixins.RetrieveModelMixin, mixins.ListModelMixin, mixins.DestroyModelMixin):
@@ -16,7 +25,7 @@ class ReportView(GenericViewSet, mixins.RetrieveModelMixin, mixins.ListModelMixi
     测试报告视图
     """
     serializer_class = serializers.ReportSerializer
-    pagination_class = pagination.MyPageNumberPagination
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     def get_queryset(self):
@@ -31,15 +40,83 @@ class ReportView(GenericViewSet, mixins.RetrieveModelMixin, mixins.ListModelMixi
             instance = self.get_object()
             self.perform_destroy(instance)
         elif request.data:
-            for content in request.data:
-                self.kwargs['pk'] = content['id']
-                instance = self.get_object()
-                self.perform_destroy(instance)
+            # 权限只与项目有关，整批检查一次
+            check_project_member(request, request.query_params['project'])
+            ids, missing = filter_ids(self.get_queryset(), request.data)
+            if missing:
+                raise exceptions.NotFound()
+            with transaction.atomic():
+                delete_details(ids)
+                models.Report.objects.filter(id__in=ids).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def retrieve(self, request, *args, **kwargs):
+        """
+        只渲染汇总信息与用例状态列表，用例详情由 case/step 接口按需加载
+        旧报告或请求参数带 full 时渲染完整报告
+        """
         instance = self.get_object()
-        report_detail = models.ReportDetail.objects.get(report=instance)
-        summary = json.loads(report_detail.summary, encoding="utf-8")
+        cases = models.ReportCase.objects.filter(report=instance).order_by('index', 'id').values('id', 'name', 'success')
+        if request.query_params.get('full') or not cases.exists():
+            summary = format_summary(load_report_summary(instance), prettify=instance.project.report_prettify)
+            summary["html_report_name"] = instance.name
+            return render_to_response('report_template.html', summary)
+
+        summary = json.loads(instance.summary)
         summary["html_report_name"] = instance.name
-        return render_to_response('report_template.html', summary)
+        summary["cases"] = list(cases)
+        # 页面可能由前端请求后写入新窗口，按需加载使用绝对地址，以只对该报告有效的签名代替登录凭证
+        query = request.GET.copy()
+        for key in ('page', 'size', 'full', 'sign'):
+            query.pop(key, None)
+        query['sign'] = get_report_sign(instance.id)
+        summary["report_url"] = request.build_absolute_uri(request.path)
+        summary["query"] = query.urlencode()
+        summary["page_size"] = REPORT_STEP_PAGE_SIZE
+        resp = render_to_response('report_index.html', summary)
+        resp['Cache-Control'] = 'no-store'
+        return resp
+
+    def get_case(self, case_id):
+        """
+        按需加载的接口由 IsReportReadable 校验报告的访问权限
+        """
+        return models.ReportCase.objects.get(report_id=self.kwargs['pk'], id=case_id)
+
+    @action(detail=True, methods=['get'], url_path=r'cases/(?P<case_id>\d+)', permission_classes=(IsReportReadable,))
+    def case(self, request, pk=None, case_id=None):
+        """
+        单个用例的详情，不含请求体与响应内容，步骤记录按 page/size 分页，count 为步骤总数
+        """
+        try:
+            page = max(1, int(request.query_params.get('page', 1)))
+            size = min(max(1, int(request.query_params.get('size', REPORT_STEP_PAGE_SIZE))), REPORT_STEP_MAX_PAGE_SIZE)
+        except ValueError:
+            raise exceptions.ParseError()
+
+        try:
+            case = self.get_case(case_id)
+        except ObjectDoesNotExist:
+            return Response(response.REPORT_CASE_NOT_EXISTS, status=status.HTTP_404_NOT_FOUND)
+        return Response(load_case_page(case, (page - 1) * size, size))
+
+    @action(detail=True, methods=['get'], url_path=r'cases/(?P<case_id>\d+)/steps/(?P<index>\d+)',
+            permission_classes=(IsReportReadable,))
+    def step(self, request, pk=None, case_id=None, index=None):
+        """
+        单个步骤的请求体与响应内容
+        请求参数带 raw 时返回原始内容，否则 text/html 响应按项目设置格式化，过长时截断
+        """
+        try:
+            case = self.get_case(case_id)
+            body = load_step_body(case, int(index))
+        except ObjectDoesNotExist:
+            return Response(response.REPORT_CASE_NOT_EXISTS, status=status.HTTP_404_NOT_FOUND)
+
+        if not request.query_params.get('raw'):
+            query = request.query_params.copy()
+            query['raw'] = 1
+            link = request.build_absolute_uri('?' + query.urlencode())
+            body["response_content"] = format_content(body["response_content"], body["content_type"],
+                                                      prettify=case.report.project.report_prettify, link=link)
+        return Response(body)
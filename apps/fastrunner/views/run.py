@@ -9,9 +9,10 @@ from djcelery import models as celery_models
 
 from fastrunner import tasks
 from fastrunner.utils.decorator import request_log
-from fastrunner.utils.host import parse_host
+from fastrunner.utils.host import compile_hosts
 from fastrunner.utils.parser import Format
 from fastrunner.utils import loader
+from fastrunner.utils.cache import load_body, load_body_values
 from fastrunner.utils.permissions import IsBelongToProject
 from fastrunner import models
 
@@ -39,7 +40,7 @@ def run_api(request):
     config = None
     if name != '请选择':
         try:
-            config = eval(models.Config.objects.get(name=name, project__id=api.project).body)
+            config = load_body(models.Config.objects.get(name=name, project__id=api.project))
         except ObjectDoesNotExist:
             logger.error("指定配置文件不存在:{name}".format(name=name))
             return Response(config_err)
@@ -51,6 +52,7 @@ def run_api(request):
         host_info = json.loads(host.hostInfo)
         temp_config.extend(host_info["variables"])
         temp_baseurl = host.base_url if host.base_url else ''
+    resolver = compile_hosts(host)
 
     if config and host != "请选择":
         config["variables"].extend(temp_config)
@@ -64,14 +66,8 @@ def run_api(request):
             }
         }
 
-    # if host != "请选择":
-    #     try:
-    #         host = models.HostIP.objects.get(name=host, project__id=api.project).value.splitlines()
-    #         api.testcase = parse_host(host, api.testcase)
-    #     except ObjectDoesNotExist:
-    #         logger.error("指定域名不存在:{name}".format(name=host))
     try:
-        summary = loader.debug_api(api.testcase, api.project, config=parse_host(host, config))
+        summary = loader.debug_api(resolver.resolve(api.testcase), api.project, config=resolver.resolve(config))
     except Exception as e:
         return Response({'traceback': str(e)}, status=400)
     return Response(summary)
@@ -85,8 +81,8 @@ def run_api_pk(request, **kwargs):
     host = request.query_params["host"]
     api = models.API.objects.get(id=kwargs['pk'])
     name = request.query_params["config"]
-    config = None if name == '请选择' else eval(models.Config.objects.get(name=name, project=api.project).body)
-    test_case = eval(api.body)
+    config = None if name == '请选择' else load_body(models.Config.objects.get(name=name, project=api.project))
+    test_case = load_body(api)
 
     temp_config = []
     temp_baseurl = ''
@@ -95,6 +91,7 @@ def run_api_pk(request, **kwargs):
         host_info = json.loads(host.hostInfo)
         temp_config.extend(host_info["variables"])
         temp_baseurl = host.base_url if host.base_url else ''
+    resolver = compile_hosts(host)
 
     if config and host != "请选择":
         config["variables"].extend(temp_config)
@@ -107,14 +104,8 @@ def run_api_pk(request, **kwargs):
                 "base_url": temp_baseurl
             }
         }
-    # if host != "请选择":
-    #     try:
-    #         host = models.HostIP.objects.get(name=host, project=api.project).value.splitlines()
-    #         test_case = parse_host(host, test_case)
-    #     except ObjectDoesNotExist:
-    #         logger.error("指定域名不存在:{name}".format(name=host))
     try:
-        summary = loader.debug_api(test_case, api.project.id, config=parse_host(host, config))
+        summary = loader.debug_api(resolver.resolve(test_case), api.project.id, config=resolver.resolve(config))
     except Exception as e:
         return Response({'traceback': str(e)}, status=400)
 
@@ -141,7 +132,7 @@ def run_api_tree(request):
     name = request.data["name"]
     config = request.data["config"]
 
-    config = None if config == '请选择' else eval(models.Config.objects.get(name=config, project__id=project).body)
+    config = None if config == '请选择' else load_body(models.Config.objects.get(name=config, project__id=project))
     test_case = []
 
     temp_config = []
@@ -151,6 +142,7 @@ def run_api_tree(request):
         host_info = json.loads(host.hostInfo)
         temp_config.extend(host_info["variables"])
         temp_baseurl = host.base_url if host.base_url else ''
+    resolver = compile_hosts(host)
 
     if config and host != "请选择":
         config["variables"].extend(temp_config)
@@ -165,18 +157,18 @@ def run_api_tree(request):
         }
 
     for relation_id in relation:
-        api = models.API.objects.filter(project__id=project, relation=relation_id).order_by('id').values('body')
+        api = models.API.objects.filter(project__id=project, relation=relation_id).order_by('id').values('id', 'body', 'update_time')
         for content in api:
-            api = eval(content['body'])
-            test_case.append(parse_host(host, api))
+            api = load_body_values(models.API, content)
+            test_case.append(resolver.resolve(api))
 
     if back_async:
-        tasks.async_debug_api.delay(test_case, project, name, config=parse_host(host, config))
+        tasks.async_debug_api.delay(test_case, project, name, config=resolver.resolve(config))
         summary = loader.TEST_NOT_EXISTS
         summary["msg"] = "接口运行中，请稍后查看报告"
     else:
         try:
-            summary = loader.debug_api(test_case, project, config=parse_host(host, config))
+            summary = loader.debug_api(test_case, project, config=resolver.resolve(config))
         except Exception as e:
             return Response({'traceback': str(e)}, status=400)
 
@@ -196,7 +188,7 @@ def run_testsuite_pk(request, **kwargs):
         }
     """
     pk = kwargs["pk"]
-    test_list = models.CaseStep.objects.filter(case__id=pk).order_by("step").values("body")
+    test_list = models.CaseStep.objects.filter(case__id=pk).order_by("step").values("id", "body", "update_time")
 
     project = request.data["project"]
     name = request.data["name"]
@@ -218,15 +210,16 @@ def run_testsuite_pk(request, **kwargs):
         host_info = json.loads(host.hostInfo)
         temp_config.extend(host_info["variables"])
         temp_baseurl = host.base_url if host.base_url else ''
+    resolver = compile_hosts(host)
 
     for content in test_list:
-        body = eval(content["body"])
+        body = load_body_values(models.CaseStep, content)
 
         if "base_url" in body["request"].keys():
-            config = eval(models.Config.objects.get(name=body["name"], project__id=project).body)
+            config = load_body(models.Config.objects.get(name=body["name"], project__id=project))
             continue
 
-        test_case.append(parse_host(host, body))
+        test_case.append(resolver.resolve(body))
 
     if config and host != "请选择":
         config["variables"].extend(temp_config)
@@ -242,11 +235,11 @@ def run_testsuite_pk(request, **kwargs):
 
     try:
         if back_async:
-            tasks.async_debug_test.delay(test_case, project, name=name, report_name=report_name, config=parse_host(host, config), test_data=test_data)
+            tasks.async_debug_test.delay(test_case, project, name=name, report_name=report_name, config=resolver.resolve(config), test_data=test_data)
             summary = loader.TEST_NOT_EXISTS
             summary["msg"] = "用例运行中，请稍后查看报告"
         else:
-            summary = loader.debug_api(test_case, project, name=name, config=parse_host(host, config), save=True, test_data=test_data, report_name=report_name)
+            summary = loader.debug_api(test_case, project, name=name, config=resolver.resolve(config), save=True, test_data=test_data, report_name=report_name)
         return Response(summary)
     except Exception as e:
         return Response({'traceback': str(e)}, status=400)
@@ -277,6 +270,7 @@ def run_suite_tree(request):
         name: str
         async: bool
         host: str
+        workers: int 可选，并行执行的用例集数量
     }
     """
     # order by id default
@@ -285,6 +279,7 @@ def run_suite_tree(request):
         relation = request.data["relation"]
         report_name = request.data["name"]
         host = request.data["host"]
+        workers = request.data.get("workers")
 
         temp_config = []
         temp_baseurl = ''
@@ -293,41 +288,30 @@ def run_suite_tree(request):
             host_info = json.loads(host.hostInfo)
             temp_config.extend(host_info["variables"])
             temp_baseurl = host.base_url if host.base_url else ''
+        resolver = compile_hosts(host)
 
         test_sets = []
         suite_list = []
         config_list = []
-        for relation_id in relation:
-            suite = list(models.Case.objects.filter(project__id=project,
-                                                    relation=relation_id).order_by('id').values('id', 'name'))
-            for content in suite:
-                test_list = models.CaseStep.objects.filter(case__id=content["id"]).order_by("step").values("body")
-
-                testcase_list = []
-                config = None
-                for case_content in test_list:
-                    body = eval(case_content["body"])
-                    if "base_url" in body["request"].keys():
-                        config = eval(models.Config.objects.get(name=body["name"], project__id=project).body)
-                        continue
-                    testcase_list.append(parse_host(host, body))
-                # [[{scripts}, {scripts}], [{scripts}, {scripts}]]
-                if config and host != "请选择":
-                    config["variables"].extend(temp_config)
-                    if temp_baseurl:
-                        config["request"]["base_url"] = temp_baseurl
-                if not config and host != "请选择":
-                    config = {
-                        "variables": temp_config,
-                        "request": {
-                            "base_url": temp_baseurl
-                        }
+        for case, teststeps, config in loader.load_suites(project, relation):
+            testcase_list = resolver.resolve_all(teststeps)
+            # [[{scripts}, {scripts}], [{scripts}, {scripts}]]
+            if config and host != "请选择":
+                config["variables"].extend(temp_config)
+                if temp_baseurl:
+                    config["request"]["base_url"] = temp_baseurl
+            if not config and host != "请选择":
+                config = {
+                    "variables": temp_config,
+                    "request": {
+                        "base_url": temp_baseurl
                     }
-                config_list.append(parse_host(host, config))
-                test_sets.append(testcase_list)
-                suite_list = suite_list + suite
+                }
+            config_list.append(resolver.resolve(config))
+            test_sets.append(testcase_list)
+            suite_list.append(case)
 
-        tasks.async_debug_suite.delay(test_sets, project, suite_list, report_name, config_list)
+        tasks.async_debug_suite.delay(test_sets, project, suite_list, report_name, config_list, workers=workers)
         summary = loader.TEST_NOT_EXISTS
         summary["msg"] = "用例运行中，请稍后查看报告"
 
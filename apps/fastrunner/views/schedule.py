@@ -1,6 +1,7 @@
 import json
 import re
 
+from django.db import transaction
 from django.utils.decorators import method_decorator
 from rest_framework.viewsets import ModelViewSet
 from rest_framework import status
@@ -12,7 +13,8 @@ from djcelery import models as celery_models
 from FasterRunner import pagination
 from fastrunner import serializers
 from fastrunner.utils.decorator import request_log
-from fastrunner.utils.permissions import IsBelongToProject
+from fastrunner.utils.prepare import filter_ids
+from fastrunner.utils.permissions import IsBelongToProject, check_project_member
 
 
 class ScheduleView(ModelViewSet):
@@ -86,10 +88,13 @@ class ScheduleView(ModelViewSet):
             instance = self.get_object()
             self.perform_destroy(instance)
         elif request.data:
-            for content in request.data:
-                self.kwargs['pk'] = content['id']
-                instance = self.get_object()
-                self.perform_destroy(instance)
+            # 权限只与项目有关，整批检查一次
+            check_project_member(request, request.query_params['project'])
+            ids, missing = filter_ids(self.get_queryset(), request.data)
+            if missing:
+                raise exceptions.NotFound()
+            with transaction.atomic():
+                celery_models.PeriodicTask.objects.filter(id__in=ids).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
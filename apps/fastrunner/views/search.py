@@ -0,0 +1,35 @@
+# _*_ coding: utf-8 _*_
+from django.utils.decorators import method_decorator
+from rest_framework.viewsets import GenericViewSet
+from rest_framework.permissions import DjangoModelPermissions
+from rest_framework.response import Response
+
+from FasterRunner import pagination
+from fastrunner import models
+from fastrunner.utils import response, search
+from fastrunner.utils.decorator import request_log
+from fastrunner.utils.permissions import IsBelongToProject
+
+
+class SearchView(GenericViewSet):
+    """
+    在项目内按名称、url 及主体信息搜索接口、用例、配置
+    """
+    queryset = models.SearchToken.objects
+    pagination_class = pagination.MyPageNumberPagination
+    permission_classes = (DjangoModelPermissions, IsBelongToProject)
+
+    @method_decorator(request_log(level='DEBUG'))
+    def list(self, request):
+        """
+        查询参数 project: int, kind: api/case/config, search: str
+        """
+        project = request.query_params['project']
+        kind = request.query_params.get('kind', search.KIND_API)
+        query = request.query_params.get('search', '')
+
+        if kind not in search.MODELS:
+            return Response(response.SEARCH_KIND_ERROR)
+
+        rows = self.paginate_queryset(search.search(project, kind, query))
+        return self.get_paginated_response(search.load_results(kind, rows))
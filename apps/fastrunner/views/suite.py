@@ -1,14 +1,18 @@
 from django.utils.decorators import method_decorator
 from rest_framework.viewsets import ModelViewSet, GenericViewSet, mixins
 from rest_framework import status
+from rest_framework import exceptions
 from rest_framework.response import Response
 from rest_framework.permissions import DjangoModelPermissions
 
 from fastrunner import models, serializers
 from FasterRunner import pagination
 from fastrunner.utils import prepare
+from fastrunner.utils import search as search_index
+from fastrunner.utils.cache import load_body
 from fastrunner.utils.decorator import request_log
-from fastrunner.utils.permissions import IsBelongToProject
+from fastrunner.utils.parser import dumps_body
+from fastrunner.utils.permissions import IsBelongToProject, check_project_member
 
 
 class TestCaseView(ModelViewSet):
@@ -33,7 +37,7 @@ class TestCaseView(ModelViewSet):
         }
     """
     serializer_class = serializers.CaseSerializer
-    pagination_class = pagination.MyPageNumberPagination
+    pagination_class = pagination.ProjectPagination
     permission_classes = (DjangoModelPermissions, IsBelongToProject)
 
     def get_queryset(self):
@@ -64,11 +68,12 @@ class TestCaseView(ModelViewSet):
             serializer = self.get_serializer(data=request_data)
             serializer.is_valid(raise_exception=True)
             self.perform_create(serializer)
-            case_step = models.CaseStep.objects.filter(case__id=pk)
+            case_step = list(models.CaseStep.objects.filter(case__id=pk))
             for step in case_step:
                 step.id = None
                 step.case_id = serializer.data["id"]
-                step.save()
+            models.CaseStep.objects.bulk_create(case_step, batch_size=prepare.BULK_BATCH_SIZE)
+            search_index.index_case(serializer.data["id"])
         else:
             body = request.data.pop('body')
             serializer = self.get_serializer(data=request.data)
@@ -109,11 +114,12 @@ class TestCaseView(ModelViewSet):
             prepare.case_end(int(kwargs['pk']), project_id)
             self.perform_destroy(instance)
         elif request.data:
-            for content in request.data:
-                self.kwargs['pk'] = content['id']
-                instance = self.get_object()
-                prepare.case_end(int(kwargs['pk']), project_id)
-                self.perform_destroy(instance)
+            # 权限只与项目有关，整批检查一次
+            check_project_member(request, project_id)
+            ids, missing = prepare.filter_ids(self.get_queryset(), request.data)
+            if missing:
+                raise exceptions.NotFound()
+            prepare.cases_end(ids, project_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @method_decorator(request_log(level='INFO'))
@@ -149,8 +155,8 @@ class TestCaseSynchronize(GenericViewSet, mixins.UpdateModelMixin):
         case_step = models.CaseStep.objects.filter(case_id=case_id).order_by('step')
         for case in case_step:
             if case.method != 'config':
-                api_body = eval(models.API.objects.get(id=case.apiId).body)
-                csae_body = eval(case.body)
+                api_body = load_body(models.API.objects.get(id=case.apiId))
+                csae_body = load_body(case)
                 csae_body["request"] = api_body["request"]
                 csae_body["desc"]["header"] = api_body["desc"]["header"]
                 csae_body["desc"]["data"] = api_body["desc"]["data"]
@@ -159,7 +165,7 @@ class TestCaseSynchronize(GenericViewSet, mixins.UpdateModelMixin):
 
                 case.url = api_body["request"]["url"]
                 case.method = api_body["request"]["method"]
-                case.body = csae_body
+                case.body = dumps_body(csae_body)
                 case.save()
 
         case_request_data = {}
@@ -15,7 +15,8 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "FasterRunner.settings")
 import django
 django.setup()
 
-from fastrunner.utils.parser import Format
+from fastrunner.utils.parser import Format, dumps_body
+from fastrunner.utils import tree
 from fastrunner import models
 
 
@@ -42,30 +43,6 @@ def load_json_file(json_file):
         return json_content
 
 
-def get_tree_max_id(value, list_id=[]):
-    """
-    得到最大Tree max id
-    """
-    if not value:
-        return 0  # the first node id
-
-    if isinstance(value, list):
-        for content in value:  # content -> dict
-            try:
-                children = content['children']
-            except KeyError:
-                """
-                待返回错误信息
-                """
-                pass
-            if children:
-                get_tree_max_id(children)
-
-            list_id.append(content['id'])
-
-    return max(list_id)
-
-
 def get_desc(content):
     desc_dict = {}
     if isinstance(content, dict):
@@ -190,17 +167,17 @@ def paeser_api(content):
     return request_data
 
 
-def save_api(request_data, now_tree):
+def save_api(request_data, node_id):
     if request_data:
         api = Format(request_data)
         api.parse()
         api_body = {
             'name': api.name,
-            'body': api.testcase,
+            'body': dumps_body(api.testcase),
             'url': api.url,
             'method': api.method,
             'project_id': PROJECT_ID,
-            'relation': now_tree["id"]
+            'relation': node_id
         }
         print(api_body)
         try:
@@ -210,22 +187,12 @@ def save_api(request_data, now_tree):
 
 
 # 递归处理
-def import_api_data(file_path, now_tree):
+def import_api_data(file_path, node_id):
     """
     file_path: import api dir path
-    global_id: now api_tree max_id
+    node_id: 目录对应的树节点
     dowhat:
-        make {
-            "id":max_id,
-            'lable': 'api',
-            'children': [
-                {
-                "id":max_id++,
-                'lable': 'dir_name',
-                children: []
-                }
-            ]
-        }
+        文件保存为节点下的接口，子目录通过 tree.add_node 新增为子节点后递归处理
     """
 
     path_dir = os.listdir(file_path)
@@ -236,24 +203,15 @@ def import_api_data(file_path, now_tree):
             if file_suffix == '.json':
                 file_content = load_json_file(now_dir_path)
                 request_data = paeser_api(file_content)
-                save_api(request_data, now_tree)
+                save_api(request_data, node_id)
             elif file_suffix in ['.yaml', '.yml']:
                 file_content = load_yaml_file(now_dir_path)
                 request_data = paeser_api(file_content)
-                save_api(request_data, now_tree)
+                save_api(request_data, node_id)
 
         elif os.path.isdir(now_dir_path):
-            global max_tree_id
-            max_tree_id += 1
-            next_tree = {
-                "label": os.path.basename(now_dir_path),
-                "id": max_tree_id + 1,
-                "children": []
-            }
-            now_tree["children"].append(next_tree)
-            import_api_data(now_dir_path, next_tree)
-            global new_tree
-            new_tree.append(now_tree)
+            node = tree.add_node(relation, node_id, os.path.basename(now_dir_path))
+            import_api_data(now_dir_path, node.node_id)
 
 
 if __name__ == '__main__':
@@ -261,18 +219,8 @@ if __name__ == '__main__':
     PROJECT_ID = 6  # 看自己现在的项目id
 
     TREE_TYPE = 1
-    relation = models.Relation.objects.get(project__id=PROJECT_ID, type=TREE_TYPE)
-    tree = eval(relation.tree)
-    max_tree_id = get_tree_max_id(tree)
-    now_tree = {
-        "label": os.path.basename(MY_API_FILEPATH),
-        "id": max_tree_id + 1,
-        "children": []
-    }
-    new_tree = []
-    import_api_data(MY_API_FILEPATH, now_tree)
-    tree.append(new_tree[-1])
-    relation.tree = tree
-    print(relation.tree)
-
-    relation.save()
+    # 节点通过 tree.add_node 写入节点表，与页面上新增的节点共用 max_id
+    relation = tree.get_relation(PROJECT_ID, TREE_TYPE)
+    root = tree.add_node(relation, 0, os.path.basename(MY_API_FILEPATH))
+    import_api_data(MY_API_FILEPATH, root.node_id)
+    print(root.node_id)